@@ -0,0 +1,221 @@
+# aggregation.py
+
+import math
+import numpy as np
+
+from db_utils import DB_NAME, cached_query, get_from_base,\
+ read_connection, subquery
+from itertools import chain
+from latency_sketch import EXACT_LIMIT, SKETCH_METRICS, SUB_BITS
+
+
+def quantile_of(mode: str) -> float | None:
+    '''Translate an aggregation mode into a quantile: 'median' -> 0.5,
+    'pNN' -> NN / 100. Returns None for the mean ('avg', 'mean', anything
+    else).
+    '''
+    if mode == 'median':
+        return 0.5
+    if mode.startswith('p') and mode[1:].isdigit() and int(mode[1:]) <= 100:
+        return int(mode[1:]) / 100
+    return None
+
+
+def load_metric_columns(
+ query: str, db_name: str=DB_NAME
+ ) -> tuple[list[str], list[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load a 'group, x, metric1, metric2, ...' query as NumPy columns in one
+    pass over streamed row chunks, without building an intermediate list of
+    all rows.
+
+    Results go through the result cache: switching between the mean and
+    percentiles of unchanged data does not query it again.
+
+    Returns:
+        (column names, group labels, group codes (int32, index into the
+        labels), x values (int64), metrics (float64, one column per metric,
+        NaN for NULL))
+    """
+    return cached_query('metric_columns', query, db_name,
+                        lambda: _load_metric_columns(query, db_name))
+
+
+def _load_metric_columns(
+ query: str, db_name: str
+ ) -> tuple[list[str], list[str], np.ndarray, np.ndarray, np.ndarray]:
+    columns, chunks = get_from_base(query, 'stream', db_name)
+    n_metrics = len(columns) - 2
+    codes: dict[str, int] = {}
+
+    def encode(row: tuple) -> tuple:
+        # Dictionary-encode the group, NULL metrics become NaN
+        return (codes.setdefault(row[0], len(codes)), row[1],
+                *(math.nan if v is None else v for v in row[2:]))
+
+    dtype = [('g', 'i4'), ('x', 'i8')]\
+        + [(f'm{i}', 'f8') for i in range(n_metrics)]
+    table = np.fromiter(map(encode, chain.from_iterable(chunks)),
+                        dtype=dtype)
+
+    metrics = np.column_stack([table[f'm{i}'] for i in range(n_metrics)])\
+        if n_metrics else np.empty((len(table), 0))
+    return columns, list(codes), table['g'], table['x'], metrics
+
+
+def grouped_aggregate(
+ groups: np.ndarray, x: np.ndarray, values: np.ndarray, mode: str
+ ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Aggregate values for every (group, x) bucket at once.
+
+    A single lexsort orders the values inside each bucket; bucket
+    boundaries come from changes of (group, x), the mean from
+    np.add.reduceat and quantiles from index arithmetic with linear
+    interpolation (the same result as np.percentile). NaN values are
+    ignored.
+
+    Returns:
+        (group of each bucket, x of each bucket, aggregated value)
+    """
+    keep = ~np.isnan(values)
+    groups, x, values = groups[keep], x[keep], values[keep]
+    if not len(values):
+        return groups, x, values
+
+    order = np.lexsort((values, x, groups))
+    groups, x, values = groups[order], x[order], values[order]
+    boundary = np.empty(len(values), dtype=bool)
+    boundary[0] = True
+    boundary[1:] = (groups[1:] != groups[:-1]) | (x[1:] != x[:-1])
+    starts = np.flatnonzero(boundary)
+    counts = np.diff(np.append(starts, len(values)))
+
+    q = quantile_of(mode)
+    if q is None:
+        result = np.add.reduceat(values, starts) / counts
+    else:
+        position = starts + q * (counts - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        result = values[low] + (values[high] - values[low]) * (position - low)
+    return groups[starts], x[starts], result
+
+
+def aggregate_series(
+ query: str, mode: str, db_name: str=DB_NAME
+ ) -> tuple[list[str], dict[str, list[tuple[np.ndarray, np.ndarray]]]]:
+    """
+    Run a 'group, x, metrics...' query and aggregate every metric per group
+    and x value.
+
+    Returns:
+        (column names, {group label: [(x values, y values) per metric]})
+    """
+    columns, labels, groups, x, metrics = load_metric_columns(query, db_name)
+    series: dict[str, list[tuple[np.ndarray, np.ndarray]]] = {
+        label: [] for label in labels}
+    for i in range(metrics.shape[1]):
+        agg_groups, agg_x, agg_y = grouped_aggregate(
+            groups, x, metrics[:, i], mode)
+        for code, label in enumerate(labels):
+            mask = agg_groups == code
+            series[label].append((agg_x[mask], agg_y[mask]))
+    return columns, series
+
+
+def bucket_values(buckets: np.ndarray) -> np.ndarray:
+    '''Vectorized midpoint of latency_sketch buckets, in nanoseconds.'''
+    buckets = buckets.astype(np.int64)
+    shift = np.maximum((buckets >> SUB_BITS) - 1, 0)
+    mantissa = buckets - (shift << SUB_BITS)
+    mid = (mantissa << shift) + ((1 << shift) - 1) / 2
+    return np.where(buckets < EXACT_LIMIT, buckets, mid).astype(np.float64)
+
+
+def sketch_aggregate(
+ metric: str, mode: str, db_name: str=DB_NAME, per_x: bool=True,
+ run_id: int | None=None
+ ) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Aggregate one sketched metric from latency_hist, reading bucket counts
+    (kilobytes) instead of raw rows.
+
+    Quantiles take the first bucket whose cumulative count reaches the
+    requested rank, found for every (group, x) at once with searchsorted
+    over the global cumulative sum; the mean weights bucket midpoints.
+    Values are returned in the metric's own units.
+
+    Args:
+        per_x: False merges all clients_total of a server into one bucket
+            set (x is then 0).
+        run_id: test run to read, by default the latest run of every
+            server (see the latest_run view).
+
+    Returns:
+        (group labels, group codes, x values, aggregated values)
+    """
+    # A bare 0 in GROUP BY / ORDER BY would be read as a column position
+    x_select, x_key = ('clients_total', 'clients_total, ') if per_x\
+        else ('0 AS x', '')
+    if run_id is None:
+        runs, params = "JOIN latest_run USING (server_type, run_id) ", ()
+    else:
+        runs, params = "", (run_id,)
+    query = (
+        f"SELECT server_type, {x_select}, bucket, SUM(count) "
+        f"FROM latency_hist {runs}WHERE metric = ? {'AND run_id = ? ' if params else ''}"
+        f"GROUP BY server_type, {x_key}bucket "
+        f"ORDER BY server_type, {x_key}bucket")
+    codes: dict[str, int] = {}
+    table = np.fromiter(
+        ((codes.setdefault(row[0], len(codes)), *row[1:])
+         for row in read_connection(db_name).execute(
+             query, (metric, *params))),
+        dtype=[('g', 'i4'), ('x', 'i8'), ('b', 'i8'), ('c', 'i8')])
+    labels = list(codes)
+    if not len(table):
+        empty = np.empty(0)
+        return labels, empty.astype(np.int32), empty.astype(np.int64), empty
+
+    groups, x, counts = table['g'], table['x'], table['c']
+    values = bucket_values(table['b'])
+    boundary = np.empty(len(table), dtype=bool)
+    boundary[0] = True
+    boundary[1:] = (groups[1:] != groups[:-1]) | (x[1:] != x[:-1])
+    starts = np.flatnonzero(boundary)
+    totals = np.add.reduceat(counts, starts)
+
+    q = quantile_of(mode)
+    if q is None:
+        result = np.add.reduceat(values * counts, starts) / totals
+    else:
+        cumulative = np.cumsum(counts)
+        before = np.where(starts > 0, cumulative[starts - 1], 0)
+        rank = before + np.maximum(np.ceil(q * totals), 1)
+        result = values[np.searchsorted(cumulative, rank)]
+    return labels, groups[starts], x[starts],\
+        result / SKETCH_METRICS[metric]
+
+
+def sketch_series(
+ query: str, mode: str, db_name: str=DB_NAME
+ ) -> tuple[list[str], dict[str, list[tuple[np.ndarray, np.ndarray]]]]:
+    """
+    Same result as aggregate_series, computed from the latency sketches.
+    The query is only used for its column names: every metric column
+    must be one of latency_sketch.SKETCH_METRICS.
+    """
+    columns = [desc[0] for desc in read_connection(db_name).execute(
+        f"SELECT * FROM {subquery(query)} LIMIT 0").description]
+    missing = [col for col in columns[2:] if col not in SKETCH_METRICS]
+    if missing:
+        raise ValueError(f'no sketch for columns {missing}')
+
+    series: dict[str, list[tuple[np.ndarray, np.ndarray]]] = {}
+    for metric in columns[2:]:
+        labels, groups, x, values = sketch_aggregate(metric, mode, db_name)
+        for code, label in enumerate(labels):
+            mask = groups == code
+            series.setdefault(label, []).append((x[mask], values[mask]))
+    return columns, series
@@ -0,0 +1,224 @@
+# columnar_export.py
+
+import json
+import numpy as np
+
+from aggregation import quantile_of
+from db_utils import DB_NAME, connect, extract_column_names
+from pathlib import Path
+from typing import Any
+
+
+EXPORT_DIR = Path("exports")
+CHUNK_ROWS = 100_000  # rows fetched and converted at a time
+
+# Exported test columns: one .npy file each. Text columns are dictionary
+# encoded (int32 codes, values listed in meta.json), NULL becomes NaN in
+# float columns and -1 in integer ones (no valid value is negative)
+EXPORT_COLUMNS: dict[str, str] = {
+    'server_type': 'i4',
+    'clients_total': 'i8',
+    'client_id': 'i8',
+    'conn_attempt': 'i8',
+    'send_id': 'i8',
+    't_send_attempt': 'f8',
+    't_send_success': 'f8',
+    't_server_response': 'f8',
+    't_response': 'f8',
+    'connect_ns': 'i8',
+    'rtt_ns': 'i8',
+    'server_ns': 'i8',
+    't_intended': 'f8',
+    'co_rtt_ns': 'i8',
+    'error': 'i4',
+}
+DICTIONARY_COLUMNS = ('server_type', 'error')
+INT_NULL = -1
+
+
+def export_run(
+ run_id: int, out_dir: str | Path | None=None, db_name: str=DB_NAME,
+ chunk_rows: int=CHUNK_ROWS) -> Path:
+    """
+    Export the test rows of a run into a directory of per-column .npy files
+    plus meta.json, streaming fetchmany() chunks straight into memory-mapped
+    output arrays, so memory stays bounded by the chunk size.
+
+    Rows are ordered by (server_type, clients_total): every wave, and every
+    server, is a contiguous slice listed in meta.json.
+
+    Returns:
+        The export directory (exports/run_<id> by default).
+    """
+    out = Path(out_dir) if out_dir else EXPORT_DIR / f'run_{run_id}'
+    out.mkdir(parents=True, exist_ok=True)
+    names = list(EXPORT_COLUMNS)
+    dtype = [(name, EXPORT_COLUMNS[name]) for name in names]
+
+    # Everything but float NULLs (None -> NaN in np.fromiter) is converted
+    # by SQLite, so chunks go from fetchmany() to NumPy without Python code
+    # per row
+    select = []
+    for name, kind in EXPORT_COLUMNS.items():
+        if name in DICTIONARY_COLUMNS:
+            select.append(f"(SELECT code FROM temp.export_codes "
+                          f"WHERE name = '{name}' AND value IS test.{name})")
+        elif kind.startswith('i'):
+            select.append(f"IFNULL({name}, {INT_NULL})")
+        else:
+            select.append(name)
+
+    waves: list[list[int]] = []  # [server code, clients_total, start, stop]
+    with connect(db_name) as conn:
+        # One read transaction: the count and the rows see the same snapshot
+        conn.execute("BEGIN")
+        run = conn.execute("SELECT * FROM test_run WHERE id = ?", (run_id,))
+        run_columns = [desc[0] for desc in run.description]
+        run_row = run.fetchone()
+        if run_row is None:
+            raise ValueError(f'no test run {run_id}')
+        total = conn.execute("SELECT COUNT(*) FROM test WHERE run_id = ?",
+                             (run_id,)).fetchone()[0]
+
+        # Dictionaries from index-only scans, codes in sort order
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS export_codes ("
+            "name TEXT, value TEXT, code INTEGER, PRIMARY KEY (name, value))")
+        dictionaries: dict[str, list[str]] = {}
+        for name in DICTIONARY_COLUMNS:
+            dictionaries[name] = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT {name} FROM test WHERE run_id = ? "
+                f"ORDER BY {name}", (run_id,))]
+            conn.executemany(
+                "INSERT INTO temp.export_codes VALUES (?, ?, ?)",
+                ((name, value, code)
+                 for code, value in enumerate(dictionaries[name])))
+
+        arrays = {
+            name: np.lib.format.open_memmap(
+                out / f'{name}.npy', mode='w+',
+                dtype=EXPORT_COLUMNS[name], shape=(total,))
+            for name in names}
+
+        cur = conn.execute(
+            f"SELECT {', '.join(select)} FROM test WHERE run_id = ? "
+            "ORDER BY server_type, clients_total", (run_id,))
+        written = 0
+        while rows := cur.fetchmany(chunk_rows):
+            chunk = np.fromiter(rows, dtype=dtype, count=len(rows))
+            stop = written + len(chunk)
+            for name in names:
+                arrays[name][written:stop] = chunk[name]
+
+            # Wave boundaries: where (server_type, clients_total) changes
+            servers, totals = chunk['server_type'], chunk['clients_total']
+            changed = np.flatnonzero(
+                (servers[1:] != servers[:-1]) | (totals[1:] != totals[:-1])
+                ) + 1
+            if not waves or waves[-1][:2] != [int(servers[0]),
+                                              int(totals[0])]:
+                changed = np.insert(changed, 0, 0)
+            for start in changed.tolist():
+                if waves:
+                    waves[-1][3] = written + start
+                waves.append([int(servers[start]), int(totals[start]),
+                              written + start, stop])
+            waves[-1][3] = stop
+            written = stop
+        conn.rollback()
+
+    for array in arrays.values():
+        array.flush()
+    meta = {
+        'run': dict(zip(run_columns, run_row)),
+        'rows': written,
+        'columns': EXPORT_COLUMNS,
+        'null': {'int': INT_NULL, 'float': 'NaN'},
+        'dictionaries': dictionaries,
+        'waves': waves,
+    }
+    (out / 'meta.json').write_text(json.dumps(meta, indent=2),
+                                   encoding='utf-8')
+    return out
+
+
+def load_export(
+ path: str | Path) -> tuple[dict[str, Any], dict[str, np.ndarray]]:
+    """
+    Open an export made by export_run. Columns are memory-mapped: nothing
+    is read from disk until a slice of them is used.
+
+    Returns:
+        (meta.json contents, {column name: read-only array})
+    """
+    path = Path(path)
+    meta = json.loads((path / 'meta.json').read_text(encoding='utf-8'))
+    columns = {name: np.load(path / f'{name}.npy', mmap_mode='r')
+               for name in meta['columns']}
+    return meta, columns
+
+
+def _metric_values(column: np.ndarray, start: int, stop: int) -> np.ndarray:
+    '''One slice of a metric column as float64 without its NULLs.'''
+    values = np.asarray(column[start:stop], dtype=np.float64)
+    if column.dtype.kind == 'i':
+        return values[column[start:stop] != INT_NULL]
+    return values[~np.isnan(values)]
+
+
+def export_aggregate(
+ path: str | Path, metric: str, mode: str, per_x: bool=True
+ ) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Aggregate one column of an export per server and clients_total. Each
+    wave is a contiguous slice of the memory-mapped column, so only one
+    wave (or one server with per_x=False) is in memory at a time.
+
+    Returns:
+        (group labels, group codes, x values, aggregated values), like
+        aggregation.sketch_aggregate
+    """
+    meta, columns = load_export(path)
+    if metric not in columns or metric in DICTIONARY_COLUMNS:
+        raise ValueError(f'{metric} is not an exported metric column')
+    ranges = meta['waves']
+    if not per_x:
+        # Waves of a server are adjacent: merge them into one range
+        merged: list[list[int]] = []
+        for code, _, start, stop in ranges:
+            if merged and merged[-1][0] == code:
+                merged[-1][3] = stop
+            else:
+                merged.append([code, 0, start, stop])
+        ranges = merged
+
+    q = quantile_of(mode)
+    codes, x, result = [], [], []
+    for code, clients_total, start, stop in ranges:
+        values = _metric_values(columns[metric], start, stop)
+        if not len(values):
+            continue
+        codes.append(code)
+        x.append(clients_total)
+        result.append(values.mean() if q is None else np.quantile(values, q))
+    return meta['dictionaries']['server_type'],\
+        np.array(codes, dtype=np.int32), np.array(x, dtype=np.int64),\
+        np.array(result, dtype=np.float64)
+
+
+def export_series(
+ path: str | Path, query: str, mode: str
+ ) -> tuple[list[str], dict[str, list[tuple[np.ndarray, np.ndarray]]]]:
+    """
+    Same result as aggregation.aggregate_series, computed from an export
+    instead of SQLite. The query is only used for its column names: a
+    'server_type, clients_total, metrics...' select of test columns.
+    """
+    columns = extract_column_names(query)
+    series: dict[str, list[tuple[np.ndarray, np.ndarray]]] = {}
+    for metric in columns[2:]:
+        labels, groups, x, values = export_aggregate(path, metric, mode)
+        for code, label in enumerate(labels):
+            mask = groups == code
+            series.setdefault(label, []).append((x[mask], values[mask]))
+    return columns, series
@@ -1,18 +1,115 @@
 # db_utils.py
 
+import multiprocessing
+import os
+import platform
+import queue
 import re
+import socket
 import sqlite3
+import threading
+import time
 
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from operator import itemgetter
+from latency_sketch import LatencySketch
+from query_cache import result_cache
 from query_loader import get_query
-from typing import Any
-from types_common import NamedQueue
+from typing import Any, TypeVar
+from types_common import LogData, LogQueue, MPQueue, NamedQueue
 
 
 DB_NAME = "statistics.sqlite"
 
+T = TypeVar('T')
+
+
+@contextmanager
+def connect(db_name: str=DB_NAME) -> Iterator[sqlite3.Connection]:
+    '''sqlite3.connect() that commits like `with conn:` and also closes.
+    A bare Connection stays open in a reference cycle until the next garbage
+    collection; forked servers inherit it, close it on exit and unlink the
+    WAL under the log writer.
+    '''
+    conn = sqlite3.connect(db_name)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+# Monotonic timings (integer nanoseconds), added to existing databases too
+TEST_NS_COLUMNS = {
+    'connect_ns': 'INTEGER',  # first connect attempt -> connection up
+    'rtt_ns': 'INTEGER',  # request send -> full response, client clock
+    'server_ns': 'INTEGER',  # request read -> response sent, server clock
+}
+# Open-loop load: intended send time and latency measured from it
+OPEN_LOOP_COLUMNS = {
+    't_intended': 'REAL',  # wall clock time the schedule meant to send at
+    'co_rtt_ns': 'INTEGER',  # intended send -> full response, client clock
+}
+# Load shape of a run: open-loop rate, wave ramp and where it found the
+# server failing
+RUN_LOAD_COLUMNS = {
+    'target_rps': 'REAL',  # open-loop requests per second, NULL if closed
+    'soak_seconds': 'REAL',  # duration of a soak run, NULL for waves
+    'ramp': 'TEXT',  # strategy and failure thresholds
+    'knee': 'INTEGER',  # largest wave that passed
+    'breaking_point': 'INTEGER',  # smallest wave that failed
+    'failure': 'TEXT',  # why it failed
+}
+# Every logged row belongs to one test_run
+RUN_ID_COLUMN = {'run_id': 'INTEGER REFERENCES test_run(id)'}
+RUN_TABLES = ('test', 'server_log', 'server_stats', 'latency_hist',
+              'wave_clients', 'wave_summary', 'soak_series', 'server_metrics')
+
+
+def _add_missing_columns(
+ cur: sqlite3.Cursor, table: str, columns: dict[str, str]) -> None:
+    existing = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+    for name, col_type in columns.items():
+        if name not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type};")
+
+
+def _table_columns(cur: sqlite3.Cursor, table: str) -> list[str]:
+    return [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+
+
+def _adopt_legacy_rows(cur: sqlite3.Cursor) -> None:
+    '''Databases written before test_run existed: give every server_type
+    found in rows without a run_id a run of its own (with unknown
+    parameters), so old results stay visible and never blend with new runs.
+    '''
+    legacy_hist = bool(cur.execute(
+     "SELECT 1 FROM sqlite_master WHERE name = 'latency_hist_legacy'"
+     ).fetchone())
+    sources = [f"SELECT server_type FROM {table} WHERE run_id IS NULL"
+               for table in ('test', 'server_log', 'server_stats')]
+    if legacy_hist:
+        sources.append("SELECT server_type FROM latency_hist_legacy")
+    for (server_type,) in cur.execute(
+     " UNION ".join(sources)).fetchall():
+        cur.execute("INSERT INTO test_run (server_type) VALUES (?)",
+                    (server_type,))
+        run_id = cur.lastrowid
+        for table in ('test', 'server_log', 'server_stats'):
+            cur.execute(f"UPDATE {table} SET run_id = ? "
+                        "WHERE run_id IS NULL AND server_type IS ?",
+                        (run_id, server_type))
+        if legacy_hist:
+            cur.execute("INSERT INTO latency_hist SELECT ?, * "
+                        "FROM latency_hist_legacy WHERE server_type IS ?",
+                        (run_id, server_type))
+    if legacy_hist:
+        cur.execute("DROP TABLE latency_hist_legacy;")
+
 
 def init_db(DB_NAME: str=DB_NAME, new: bool=False) -> None:
-    with sqlite3.connect(DB_NAME) as conn:
+    with connect(DB_NAME) as conn:
         cur = conn.cursor()
         #  Write-Ahead Logging (WAL) mode in SQLite:
         #  Increased concurrency;
@@ -22,8 +119,31 @@ def init_db(DB_NAME: str=DB_NAME, new: bool=False) -> None:
         #  Should be set immediately after connecting to the database
         cur.execute("PRAGMA journal_mode=WAL;")
         if new:
-            cur.execute("DROP TABLE IF EXISTS test;")
-            cur.execute("DROP TABLE IF EXISTS server_log;")
+            for table in RUN_TABLES + ('test_run',):
+                cur.execute(f"DROP TABLE IF EXISTS {table};")
+
+        # One row per run_test_suite() call: what was tested and where.
+        # AUTOINCREMENT: ids of deleted or archived runs are never reused
+        # in this database (see archive_runs for ids across files)
+        cur.execute(
+         "CREATE TABLE IF NOT EXISTS test_run ("
+         "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+         "started_at REAL,"
+         "finished_at REAL,"
+         "server_type TEXT,"
+         "client_engine TEXT,"
+         "client_shards INTEGER,"
+         "payload_size INTEGER,"
+         "exchanges INTEGER,"
+         "pipeline_depth INTEGER,"
+         "raw_rows INTEGER,"
+         "hostname TEXT,"
+         "platform TEXT,"
+         "cpu_count INTEGER,"
+         "python TEXT"
+         ");"
+         )
+        _add_missing_columns(cur, 'test_run', RUN_LOAD_COLUMNS)
         cur.execute(
          "CREATE TABLE IF NOT EXISTS test ("
          "id INTEGER PRIMARY KEY,"
@@ -39,6 +159,8 @@ def init_db(DB_NAME: str=DB_NAME, new: bool=False) -> None:
          "error TEXT"
          ");"
          )
+        _add_missing_columns(cur, 'test', TEST_NS_COLUMNS)
+        _add_missing_columns(cur, 'test', OPEN_LOOP_COLUMNS)
 
         cur.execute(
          "CREATE TABLE IF NOT EXISTS server_log ("
@@ -51,66 +173,605 @@ def init_db(DB_NAME: str=DB_NAME, new: bool=False) -> None:
          ");"
          )
 
+        # Per-wave measurements reported by the servers (CPU time etc.)
+        cur.execute(
+         "CREATE TABLE IF NOT EXISTS server_stats ("
+         "id INTEGER PRIMARY KEY,"
+         "server_type TEXT,"
+         "clients_total INTEGER,"
+         "metric TEXT,"
+         "value REAL,"
+         "timestamp REAL"
+         ");"
+         )
+        for table in ('test', 'server_log', 'server_stats'):
+            _add_missing_columns(cur, table, RUN_ID_COLUMN)
+
+        # Soak runs: one row per second instead of one per exchange
+        cur.execute(
+         "CREATE TABLE IF NOT EXISTS soak_series ("
+         "id INTEGER PRIMARY KEY,"
+         "run_id INTEGER REFERENCES test_run(id),"
+         "server_type TEXT,"
+         "clients_total INTEGER,"  # connections kept busy
+         "second INTEGER,"  # window number since the soak started
+         "timestamp REAL,"
+         "requests INTEGER,"
+         "rps REAL,"
+         "p50_ns INTEGER,"
+         "p99_ns INTEGER,"
+         "errors INTEGER,"
+         "open_fds INTEGER,"  # server process and its children
+         "rss_bytes INTEGER"
+         ");"
+         )
+
+        # Scraped from the server under test every 100 ms (server_metrics.py)
+        cur.execute(
+         "CREATE TABLE IF NOT EXISTS server_metrics ("
+         "id INTEGER PRIMARY KEY,"
+         "run_id INTEGER REFERENCES test_run(id),"
+         "server_type TEXT,"
+         "clients_total INTEGER,"
+         "timestamp REAL,"
+         "active INTEGER,"  # connections held by the server
+         "accepted INTEGER,"  # increments since the previous row from here
+         "messages INTEGER,"
+         "bytes_in INTEGER,"
+         "bytes_out INTEGER,"
+         "loops INTEGER,"
+         "busy_ns INTEGER,"
+         "wait_ns INTEGER,"
+         "max_busy_ns INTEGER,"  # longest loop iteration since the last row
+         "backlog INTEGER"  # connections waiting in the accept queue
+         ");"
+         )
+
+        # Mergeable latency sketches (see latency_sketch.py) written at
+        # ingest time, so percentile views do not rescan the test table.
+        # Keyed by run first: a run is a contiguous range, cheap to drop
+        hist_columns = _table_columns(cur, 'latency_hist')
+        if hist_columns and 'run_id' not in hist_columns:
+            cur.execute(
+             "ALTER TABLE latency_hist RENAME TO latency_hist_legacy;")
+        cur.execute(
+         "CREATE TABLE IF NOT EXISTS latency_hist ("
+         "run_id INTEGER REFERENCES test_run(id),"
+         "server_type TEXT,"
+         "clients_total INTEGER,"
+         "metric TEXT,"
+         "bucket INTEGER,"
+         "count INTEGER,"
+         "PRIMARY KEY (run_id, server_type, clients_total, metric, bucket)"
+         ") WITHOUT ROWID;"
+         )
+        _adopt_legacy_rows(cur)
+
+        # Covering indexes for the query templates: waves are always
+        # grouped or filtered by run, server_type, clients_total (and
+        # client_id). Deleting a run is an index range scan too
+        for index in ('idx_test_wave_client', 'idx_test_wave_times',
+                      'idx_server_log_type', 'idx_server_stats_wave'):
+            cur.execute(f"DROP INDEX IF EXISTS {index};")  # pre-run layout
+        cur.execute(
+         "CREATE INDEX IF NOT EXISTS idx_test_run_wave_client ON test ("
+         "run_id, server_type, clients_total, client_id, error);")
+        cur.execute(
+         "CREATE INDEX IF NOT EXISTS idx_test_run_wave_times ON test ("
+         "run_id, server_type, clients_total, t_send_success, t_response);")
+        cur.execute(
+         "CREATE INDEX IF NOT EXISTS idx_server_log_run ON server_log ("
+         "run_id, server_type, clients_total, timestamp);")
+        cur.execute(
+         "CREATE INDEX IF NOT EXISTS idx_server_stats_run ON server_stats ("
+         "run_id, server_type, clients_total, metric);")
+        cur.execute(
+         "CREATE INDEX IF NOT EXISTS idx_soak_series_run ON soak_series ("
+         "run_id, server_type, second);")
+        cur.execute(
+         "CREATE INDEX IF NOT EXISTS idx_server_metrics_run ON server_metrics ("
+         "run_id, server_type, timestamp);")
+
+        # Per-client partial aggregates of the client rows, merged at every
+        # commit (ClientTally), and the per-wave summary built from them.
+        # Derived data: rebuilt whenever the layout changes
+        clients_exist = cur.execute(
+         "SELECT 1 FROM sqlite_master WHERE name = 'wave_clients'").fetchone()
+        cur.execute(
+         "CREATE TABLE IF NOT EXISTS wave_clients ("
+         "run_id INTEGER REFERENCES test_run(id),"
+         "server_type TEXT,"
+         "clients_total INTEGER,"
+         "client_id INTEGER,"
+         "exchanges INTEGER,"  # rows of the client
+         "ok INTEGER,"  # of them without an error
+         "min_send REAL, max_send REAL, sum_send REAL,"  # t_send_success
+         "min_response REAL, max_response REAL, sum_response REAL,"
+         "min_rtt_ns INTEGER, max_rtt_ns INTEGER, sum_rtt_ns INTEGER,"
+         "PRIMARY KEY (run_id, server_type, clients_total, client_id)"
+         ") WITHOUT ROWID;"
+         )
+        if not clients_exist:
+            cur.execute(WAVE_CLIENTS_BACKFILL_SQL)
+        if 'run_id' not in _table_columns(cur, 'wave_summary')\
+                or not clients_exist:
+            cur.execute("DROP TABLE IF EXISTS wave_summary;")
+        summary_exists = cur.execute(
+         "SELECT 1 FROM sqlite_master WHERE name = 'wave_summary'").fetchone()
+        cur.execute(
+         "CREATE TABLE IF NOT EXISTS wave_summary ("
+         "run_id INTEGER REFERENCES test_run(id),"
+         "server_type TEXT,"
+         "clients_total INTEGER,"
+         "exchanges INTEGER,"  # rows in test
+         "clients INTEGER,"  # distinct client_id
+         "full_success INTEGER,"  # clients without a single error
+         "partial_success INTEGER,"  # clients with errors and successes
+         "failed INTEGER,"  # clients without a single success
+         "errors INTEGER,"  # exchanges with an error
+         "min_send REAL, max_send REAL, sum_send REAL,"  # t_send_success
+         "min_response REAL, max_response REAL, sum_response REAL,"
+         "min_rtt_ns INTEGER, max_rtt_ns INTEGER, sum_rtt_ns INTEGER,"
+         "server_errors INTEGER,"  # rows in server_log
+         "PRIMARY KEY (run_id, server_type, clients_total)"
+         ") WITHOUT ROWID;"
+         )
+        if not summary_exists:
+            refresh_wave_summary(cur, cur.execute(
+             "SELECT DISTINCT run_id, server_type, clients_total "
+             "FROM wave_clients").fetchall())
+
+        # The newest wave run of every server: what the templates show by
+        # default, older runs stay queryable by run_id. Soak runs have no
+        # waves (soak_series has its own template). Recreated so databases
+        # made before that filter get it
+        cur.execute("DROP VIEW IF EXISTS latest_run;")
+        cur.execute(
+         "CREATE VIEW latest_run AS "
+         "SELECT server_type, MAX(id) AS run_id FROM test_run "
+         "WHERE soak_seconds IS NULL GROUP BY server_type;"
+         )
+
         conn.commit()
 
 
-def _write_log(cursor, row):
-    if row['log_type'] == 'server':
-        cursor.execute(
-             "INSERT INTO server_log ("
-             "server_type, clients_total,"
-             "error_type, message, timestamp"
-             ") VALUES (?, ?, ?, ?, ?)",
-             (
-              row["server_type"],
-              row["clients_total"],
-              row["error_type"],
-              row["message"],
-              row["timestamp"]
-             ))
-    elif row['log_type'] == 'client':
-        cursor.execute(
-             "INSERT INTO test ("
-             "server_type, client_id, conn_attempt,"
-             "clients_total, send_id, t_send_attempt,"
-             "t_send_success, t_server_response, t_response, error"
-             ")"
-             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-             (
-              row["server_type"],
-              row["client_id"],
-              row["conn_attempt"],
-              row["clients_total"],
-              row["send_id"],
-              row["t_send_attempt"],
-              row["t_send_success"],
-              row["t_server_response"],
-              row["t_response"],
-              row.get("error")
-             ))
+def start_run(
+ server_type: str | None=None, client_engine: str | None=None,
+ client_shards: int | None=None, protocol: dict | None=None,
+ raw_rows: bool | None=None, db_name: str=DB_NAME,
+ target_rps: float | None=None, soak_seconds: float | None=None) -> int:
+    '''Register a new test run with its parameters and host, return its id.'''
+    protocol = protocol or {}
+    with connect(db_name) as conn:
+        cur = conn.execute(
+         "INSERT INTO test_run (started_at, server_type, client_engine,"
+         " client_shards, payload_size, exchanges, pipeline_depth, raw_rows,"
+         " hostname, platform, cpu_count, python, target_rps, soak_seconds)"
+         " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+         (time.time(), server_type, client_engine, client_shards,
+          protocol.get('payload_size'), protocol.get('exchanges'),
+          protocol.get('pipeline_depth'), raw_rows, socket.gethostname(),
+          platform.platform(), os.cpu_count(), platform.python_version(),
+          target_rps, soak_seconds))
+        return cur.lastrowid  # type: ignore[return-value]
+
+
+def finish_run(
+ run_id: int, db_name: str=DB_NAME, ramp: str | None=None,
+ knee: int | None=None, breaking_point: int | None=None,
+ failure: str | None=None) -> None:
+    '''Record the end of a run and the knee its wave ramp found.'''
+    with connect(db_name) as conn:
+        conn.execute("UPDATE test_run SET finished_at = ?, ramp = ?, knee = ?,"
+                     " breaking_point = ?, failure = ? WHERE id = ?",
+                     (time.time(), ramp, knee, breaking_point, failure,
+                      run_id))
+
+
+def delete_runs(run_ids: list[int], db_name: str=DB_NAME) -> None:
+    '''Retire runs: drop their rows from every table, then the runs.'''
+    params = [(run_id,) for run_id in run_ids]
+    with connect(db_name) as conn:
+        for table in RUN_TABLES:
+            conn.executemany(f"DELETE FROM {table} WHERE run_id = ?", params)
+        conn.executemany("DELETE FROM test_run WHERE id = ?", params)
+
+
+def archive_runs(
+ run_ids: list[int], archive_db: str, db_name: str=DB_NAME) -> None:
+    '''
+    Move runs into another database file (created with the same schema if
+    needed) through ATTACH, then delete them here.
+
+    In WAL mode a transaction over attached files is atomic per file only,
+    so the copy is committed before the delete: an interruption may leave
+    the runs in both files, never in neither.
+
+    Archived runs keep their ids. Ids are unique within one database only:
+    one recreated with init_db(new=True), or another database archiving
+    into the same file, starts over from 1, and an interrupted archive
+    leaves the runs in both files. Archiving a run whose id the archive
+    already holds raises ValueError, copying nothing.
+    '''
+    init_db(archive_db)
+    params = [(run_id,) for run_id in run_ids]
+    with connect(db_name) as conn:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_db,))
+        archived = [run_id for run_id in run_ids if conn.execute(
+            "SELECT 1 FROM archive.test_run WHERE id = ?", (run_id,)
+            ).fetchone()]
+        if archived:
+            conn.execute("DETACH DATABASE archive")
+            raise ValueError(f'{archive_db} already holds runs {archived}')
+        with conn:
+            cur = conn.cursor()
+            cur.executemany(
+             "INSERT INTO archive.test_run SELECT * FROM test_run "
+             "WHERE id = ?", params)
+            for table in RUN_TABLES:
+                # Row ids are local to a file: let the archive assign its own
+                columns = ', '.join(
+                    col for col in _table_columns(cur, table) if col != 'id')
+                cur.executemany(
+                 f"INSERT INTO archive.{table} ({columns}) "
+                 f"SELECT {columns} FROM {table} WHERE run_id = ?", params)
+        conn.execute("DETACH DATABASE archive")
+    delete_runs(run_ids, db_name)
+
+
+# Client row fields tallied as (min, max, sum), in wave_clients order
+TALLY_METRICS = ('t_send_success', 't_response', 'rtt_ns')
+WAVE_CLIENTS_COLUMNS = (
+    'exchanges', 'ok',
+    'min_send', 'max_send', 'sum_send',
+    'min_response', 'max_response', 'sum_response',
+    'min_rtt_ns', 'max_rtt_ns', 'sum_rtt_ns',
+)
+
+
+def _merge(column: str) -> str:
+    # Scalar min() / max() / + return NULL if either side is NULL
+    kind = column[:3]
+    merged = f"{column} + excluded.{column}" if kind == 'sum'\
+        else f"{kind}({column}, excluded.{column})"
+    return f"{column} = coalesce({merged}, {column}, excluded.{column})"
+
+
+WAVE_CLIENTS_UPSERT_SQL = (
+    "INSERT INTO wave_clients VALUES (?, ?, ?, ?, "
+    + ', '.join('?' * len(WAVE_CLIENTS_COLUMNS)) + ") "
+    "ON CONFLICT(run_id, server_type, clients_total, client_id) DO UPDATE SET "
+    "exchanges = exchanges + excluded.exchanges, ok = ok + excluded.ok, "
+    + ', '.join(map(_merge, WAVE_CLIENTS_COLUMNS[2:]))
+)
+
+# wave_clients of a database that only has raw rows so far
+WAVE_CLIENTS_BACKFILL_SQL = (
+    "INSERT OR REPLACE INTO wave_clients "
+    "SELECT run_id, server_type, clients_total, client_id,"
+    " COUNT(*), coalesce(SUM(error = ''), 0),"
+    " MIN(t_send_success), MAX(t_send_success), SUM(t_send_success),"
+    " MIN(t_response), MAX(t_response), SUM(t_response),"
+    " MIN(rtt_ns), MAX(rtt_ns), SUM(rtt_ns)"
+    " FROM test WHERE run_id IS NOT NULL"
+    " GROUP BY run_id, server_type, clients_total, client_id"
+)
+
+
+class ClientTally:
+    """
+    Per-client partial aggregates of the client rows ingested since the
+    last flush, keyed by (server_type, clients_total, client_id). Merged
+    into wave_clients on every commit, so a wave's summary costs one row
+    per client instead of a scan of all its raw rows, and waves run
+    without raw rows are summarized too.
+    """
+    __slots__ = ('run_id', 'clients')
+
+    def __init__(self, run_id: int) -> None:
+        self.run_id = run_id
+        self.clients: dict[tuple[str, int, int], list[Any]] = {}
+
+    def add_row(self, row: LogData) -> None:
+        key = (row['server_type'], row['clients_total'], row['client_id'])
+        tally = self.clients.get(key)
+        if tally is None:
+            tally = self.clients[key] = [0, 0] + [None] * 9
+        tally[0] += 1
+        if row['error'] == '':
+            tally[1] += 1
+        for i, metric in zip(range(2, 11, 3), TALLY_METRICS):
+            value = row[metric]  # type: ignore[literal-required]
+            if value is None:
+                continue
+            if tally[i] is None:
+                tally[i] = tally[i + 1] = tally[i + 2] = value
+                continue
+            if value < tally[i]:
+                tally[i] = value
+            elif value > tally[i + 1]:
+                tally[i + 1] = value
+            tally[i + 2] += value
+
+    def flush(self, cursor) -> None:
+        '''Merge the tallies into wave_clients. They are kept until clear(),
+        as in LatencySketch.'''
+        if self.clients:
+            cursor.executemany(
+                WAVE_CLIENTS_UPSERT_SQL,
+                ((self.run_id, *key, *tally)
+                 for key, tally in self.clients.items()))
+
+    def clear(self) -> None:
+        self.clients.clear()
+
+
+# Aggregates with no matching rows still return one row of NULLs: waves
+# without client rows are filtered by the outer query (a HAVING without
+# GROUP BY needs SQLite 3.39)
+WAVE_SUMMARY_SQL = (
+    "INSERT OR REPLACE INTO wave_summary SELECT * FROM ("
+    "SELECT :run_id, :server_type, :clients_total,"
+    " SUM(exchanges) AS exchanges, COUNT(*),"
+    " SUM(ok = exchanges), SUM(ok > 0 AND ok < exchanges), SUM(ok = 0),"
+    " SUM(exchanges - ok),"
+    " MIN(min_send), MAX(max_send), SUM(sum_send),"
+    " MIN(min_response), MAX(max_response), SUM(sum_response),"
+    " MIN(min_rtt_ns), MAX(max_rtt_ns), SUM(sum_rtt_ns),"
+    " (SELECT COUNT(*) FROM server_log WHERE run_id = :run_id"
+    "  AND server_type = :server_type AND clients_total = :clients_total)"
+    " FROM wave_clients WHERE run_id = :run_id AND server_type = :server_type"
+    " AND clients_total = :clients_total"
+    ") WHERE exchanges IS NOT NULL"
+)
+
+
+def refresh_wave_summary(cursor, waves) -> None:
+    '''Recompute the wave_summary rows of the given (run_id, server_type,
+    clients_total) waves from wave_clients (one row per client). Waves
+    without client rows are skipped.
+    '''
+    cursor.executemany(
+        WAVE_SUMMARY_SQL,
+        ({'run_id': run_id, 'server_type': server_type,
+          'clients_total': clients_total}
+         for run_id, server_type, clients_total in waves))
+
+
+# Column order of each table's INSERT, prepared once: itemgetter turns a log
+# dict into the parameter tuple in C instead of one dict lookup per column
+TEST_COLUMNS = (
+    'server_type', 'client_id', 'conn_attempt', 'clients_total', 'send_id',
+    't_send_attempt', 't_send_success', 't_server_response', 't_response',
+    'connect_ns', 'rtt_ns', 'server_ns', 't_intended', 'co_rtt_ns', 'error'
+)
+SERVER_LOG_COLUMNS = (
+    'server_type', 'clients_total', 'error_type', 'message', 'timestamp'
+)
+SERVER_STATS_COLUMNS = (
+    'server_type', 'clients_total', 'metric', 'value', 'timestamp'
+)
+METRICS_COLUMNS = (
+    'server_type', 'clients_total', 'timestamp', 'active', 'accepted',
+    'messages', 'bytes_in', 'bytes_out', 'loops', 'busy_ns', 'wait_ns',
+    'max_busy_ns', 'backlog'
+)
+SOAK_COLUMNS = (
+    'server_type', 'clients_total', 'second', 'timestamp', 'requests', 'rps',
+    'p50_ns', 'p99_ns', 'errors', 'open_fds', 'rss_bytes'
+)
+
+LOG_TABLES = {
+    'client': ('test', TEST_COLUMNS),
+    'server': ('server_log', SERVER_LOG_COLUMNS),
+    'stats': ('server_stats', SERVER_STATS_COLUMNS),
+    'soak': ('soak_series', SOAK_COLUMNS),
+    'metrics': ('server_metrics', METRICS_COLUMNS),
+}
+
+
+def insert_sql(run_id: int | None) -> dict[str, str]:
+    '''INSERT statement of every log type, stamping rows with run_id. The id
+    is the same for everything a writer ingests, so it is inlined as a
+    literal instead of being added to each parameter tuple.
+    '''
+    run = 'NULL' if run_id is None else str(int(run_id))
+    return {
+        log_type: f"INSERT INTO {table} (run_id, {', '.join(columns)}) "
+                  f"VALUES ({run}, {', '.join('?' * len(columns))})"
+        for log_type, (table, columns) in LOG_TABLES.items()}
+
+
+ROW_GETTERS = {
+    'client': itemgetter(*TEST_COLUMNS),
+    'server': itemgetter(*SERVER_LOG_COLUMNS),
+    'stats': itemgetter(*SERVER_STATS_COLUMNS),
+    'soak': itemgetter(*SOAK_COLUMNS),
+    'metrics': itemgetter(*METRICS_COLUMNS),
+}
+
+BATCH_SIZE = 5000  # rows per commit, at most
+FLUSH_INTERVAL = 1.0  # seconds between commits while rows keep arriving
+# A commit that fails on a locked or busy database is retried, first after
+# RETRY_DELAY seconds, doubling up to MAX_RETRY_DELAY; the last one, once
+# the source has ended, for up to FINAL_RETRY_SECONDS
+RETRY_DELAY = 0.05
+MAX_RETRY_DELAY = 2.0
+FINAL_RETRY_SECONDS = 8.0
+STORE_RAW_ROWS = True  # False: keep only the latency sketches of client rows
+
+
+def _write_log(cursor, row, run_id: int | None=None):
+    log_type = row['log_type']
+    cursor.execute(insert_sql(run_id)[log_type], ROW_GETTERS[log_type](row))
+
+
+def _write_batch(
+ cursor, batch: dict[str, list[tuple[Any, ...]]],
+ sql: dict[str, str]) -> int:
+    '''Insert the accumulated parameter tuples with one executemany()
+    per table. The batch is emptied by the caller once committed. Returns
+    the number of rows written.
+    '''
+    written = 0
+    for log_type, rows in batch.items():
+        if rows:
+            cursor.executemany(sql[log_type], rows)
+            written += len(rows)
+    return written
+
+
+def _ingest(
+ conn: sqlite3.Connection, data_source: LogQueue, run_id: int,
+ batch_size: int, flush_interval: float, persistent: bool=False,
+ raw_rows: bool=True) -> None:
+    '''Drain data_source into batched inserts until the 'End' sentinel.
+    A one-shot drain also stops when the source stays empty for a second,
+    a persistent one treats that as a flush point and keeps waiting.
+    Client rows also feed the latency sketches and per-client tallies,
+    which are merged into latency_hist and wave_clients on every commit;
+    with raw_rows=False only those are kept. Every row is stored under
+    run_id.
+    '''
+    cur = conn.cursor()
+    sql = insert_sql(run_id)
+    sketch = LatencySketch(run_id)
+    tally = ClientTally(run_id)
+    dirty_waves: set[tuple[int, str, int]] = set()  # waves to re-summarize
+    batch: dict[str, list[tuple[Any, ...]]] = {
+        log_type: [] for log_type in LOG_TABLES}
+
+    def commit() -> bool:
+        # Everything accumulated goes in one transaction and is kept until
+        # it is committed: a locked or busy database only delays it
+        try:
+            _write_batch(cur, batch, sql)
+            sketch.flush(cur)
+            tally.flush(cur)
+            refresh_wave_summary(cur, dirty_waves)
+            conn.commit()
+        except sqlite3.OperationalError as ex:
+            conn.rollback()
+            print('log writer: commit failed, will retry:', ex)
+            return False
+        for rows in batch.values():
+            rows.clear()
+        sketch.clear()
+        tally.clear()
+        dirty_waves.clear()
+        return True
+
+    pending = 0
+    retry_delay = 0.0  # while commits fail
+    next_flush = time.monotonic() + flush_interval
+    try:
+        while True:
+            try:
+                row = data_source.get(timeout=min(flush_interval, 1))
+            except queue.Empty:
+                if not persistent:
+                    raise
+                row = None
+            if row == 'End':
+                break
+            if row is not None:
+                log_type = row['log_type']
+                dirty_waves.add(
+                    (run_id, row['server_type'], row['clients_total']))
+                if log_type == 'client':
+                    sketch.add_row(row)
+                    tally.add_row(row)
+                if raw_rows or log_type != 'client':
+                    batch[log_type].append(ROW_GETTERS[log_type](row))
+                    pending += 1
+            now = time.monotonic()
+            if now >= next_flush or pending >= batch_size and not retry_delay:
+                if commit():
+                    pending = 0
+                    retry_delay = 0.0
+                    next_flush = now + flush_interval
+                else:
+                    retry_delay = min(
+                        2 * retry_delay or RETRY_DELAY, MAX_RETRY_DELAY)
+                    next_flush = time.monotonic() + retry_delay
+    finally:
+        deadline = time.monotonic() + FINAL_RETRY_SECONDS
+        retry_delay = RETRY_DELAY
+        while not commit():
+            if time.monotonic() + retry_delay > deadline:
+                print(f'log writer: gave up, {pending} rows lost')
+                break
+            time.sleep(retry_delay)
+            retry_delay = min(2 * retry_delay, MAX_RETRY_DELAY)
 
 
 def send_to_base(
- data_source: NamedQueue | dict, db_name: str=DB_NAME) -> None:
-    with sqlite3.connect(db_name) as conn:
+ data_source: NamedQueue | dict, db_name: str=DB_NAME,
+ batch_size: int=BATCH_SIZE, flush_interval: float=FLUSH_INTERVAL,
+ raw_rows: bool=STORE_RAW_ROWS, run_id: int | None=None) -> None:
+    if run_id is None:
+        run_id = start_run(db_name=db_name)
+    with connect(db_name) as conn:
         conn.execute("PRAGMA journal_mode=WAl;")
-        cur = conn.cursor()
 
         if isinstance(data_source, dict):
-            _write_log(cur, data_source)
+            _write_log(conn.cursor(), data_source, run_id)
         else:
             print(data_source.name, f'connected, ({data_source.qsize()} elements)')
             try:
-                while (row := data_source.get(timeout=1)) != 'End':  # type: ignore
-                    _write_log(cur, row)
+                _ingest(conn, data_source, run_id, batch_size, flush_interval,
+                        raw_rows=raw_rows)
             except Exception as ex:
                 print('sending:', ex)
                 # break
             finally:
-                conn.commit()
                 print(data_source.name, f'sended, {data_source.qsize()} left')
 
 
+def log_writer(
+ data_source: LogQueue, db_name: str=DB_NAME,
+ batch_size: int=BATCH_SIZE, flush_interval: float=FLUSH_INTERVAL,
+ raw_rows: bool=STORE_RAW_ROWS, run_id: int | None=None) -> None:
+    '''Body of the long-lived writer process: the only place server logs
+    touch SQLite. Keeps one connection open and batch-commits until the
+    'End' sentinel arrives.
+    '''
+    if run_id is None:
+        run_id = start_run(db_name=db_name)
+    with connect(db_name) as conn:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        try:
+            _ingest(conn, data_source, run_id, batch_size, flush_interval,
+                    persistent=True, raw_rows=raw_rows)
+        except Exception as ex:
+            print('log writer:', ex)
+
+
+def start_log_writer(
+ db_name: str=DB_NAME, raw_rows: bool=STORE_RAW_ROWS,
+ run_id: int | None=None) -> tuple[multiprocessing.Process, MPQueue]:
+    '''Start the writer process and return it with the queue feeding it.'''
+    log_queue: MPQueue = multiprocessing.Queue()
+    writer = multiprocessing.Process(target=log_writer,
+                                     args=(log_queue, db_name),
+                                     kwargs={'raw_rows': raw_rows,
+                                             'run_id': run_id},
+                                     name='log_writer', daemon=True)
+    writer.start()
+    return writer, log_queue
+
+
+def stop_log_writer(
+ writer: multiprocessing.Process, log_queue: MPQueue,
+ timeout: float=10) -> None:
+    '''Flush the remaining rows and wait for the writer process to exit.'''
+    log_queue.put('End')
+    writer.join(timeout)
+    if writer.is_alive():
+        print('log writer did not finish in time')
+        writer.terminate()
+
+
 def extract_table_name(query: str) -> str | None:
     match = re.search(r'\bFROM\s+([^\s;]+)', query, re.IGNORECASE)
     if match:
@@ -118,23 +779,173 @@ def extract_table_name(query: str) -> str | None:
     return None
 
 
+def extract_column_names(query: str) -> list[str]:
+    '''Result column names of a simple SELECT (aliases win, table
+    prefixes are dropped).'''
+    match = re.search(r'\bSELECT\s+(.*?)\s+FROM\b', query,
+                      re.IGNORECASE | re.DOTALL)
+    if not match:
+        return []
+    return [column.split()[-1].split('.')[-1]
+            for column in match.group(1).split(',')]
+
+
+def subquery(query: str) -> str:
+    '''A template's SQL wrapped to be selected from: trailing ';' dropped,
+    a trailing -- comment kept off the closing parenthesis.'''
+    query = re.sub(r'[\s;]+$', '', query)
+    return f"(\n{query}\n)"
+
+
+class QueryPager:
+    """
+    Random access to the rows of a query by position, in any column order.
+
+    The result is materialized once into a TEMP table (kept in SQLite's temp
+    file, not in Python) whose rowid is the row position, so a page is a
+    rowid range lookup (keyset pagination) at any offset. Sorting rebuilds
+    that table ordered by the chosen column, inside SQLite.
+    """
+
+    def __init__(self, query: str, db_name: str=DB_NAME) -> None:
+        # Built by the caller's thread, paged from Tk callbacks afterwards
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn.execute("DROP TABLE IF EXISTS temp.pager_rows")
+        self.conn.execute(
+            f"CREATE TEMP TABLE pager_rows AS SELECT * FROM {subquery(query)}")
+        cur = self.conn.execute("SELECT * FROM temp.pager_rows LIMIT 0")
+        self.columns = [desc[0] for desc in cur.description]
+        self.total = self.conn.execute(
+            "SELECT IFNULL(MAX(rowid), 0) FROM temp.pager_rows").fetchone()[0]
+
+    def page(self, start: int, count: int) -> list[tuple[Any, ...]]:
+        '''Rows start .. start + count - 1 (0-based) of the current order.'''
+        return self.conn.execute(
+            "SELECT * FROM temp.pager_rows WHERE rowid > ? AND rowid <= ? "
+            "ORDER BY rowid", (start, start + count)).fetchall()
+
+    def sort(self, column: int, descending: bool=False) -> None:
+        '''Reorder the rows by a column (0-based), ties keep their order.'''
+        self.conn.execute("DROP TABLE IF EXISTS temp.pager_sorted")
+        self.conn.execute(
+            "CREATE TEMP TABLE pager_sorted AS SELECT * FROM temp.pager_rows "
+            f"ORDER BY {int(column) + 1} {'DESC' if descending else 'ASC'}, "
+            "rowid")
+        self.conn.execute("DROP TABLE temp.pager_rows")
+        self.conn.execute(
+            "ALTER TABLE temp.pager_sorted RENAME TO pager_rows")
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# Read connections: kept open for the whole interactive session, so page
+# cache, memory map and prepared statements survive between queries
+READ_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    f"PRAGMA mmap_size = {256 << 20}",  # bytes
+    "PRAGMA cache_size = -65536",  # negative: KiB, i.e. 64 MiB of pages
+)
+READ_STATEMENT_CACHE = 256  # prepared statements kept per connection
+
+# (pid, thread, db_name) -> connection. A forked child must neither use nor
+# close its parent's connections (see connect()): the pid in the key keeps
+# them unused there and the dict keeps them referenced, so never closed
+_read_connections: dict[tuple[int, int, str], sqlite3.Connection] = {}
+
+
+def read_connection(db_name: str=DB_NAME) -> sqlite3.Connection:
+    '''
+    Cached read-only connection of the calling process and thread. In
+    autocommit mode every query starts a new read transaction, so it sees
+    what the writers have committed meanwhile.
+    '''
+    key = (os.getpid(), threading.get_ident(), db_name)
+    conn = _read_connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(db_name, isolation_level=None,
+                               cached_statements=READ_STATEMENT_CACHE)
+        for pragma in READ_PRAGMAS:
+            conn.execute(pragma)
+        _read_connections[key] = conn
+    return conn
+
+
+# What changes whenever rows are logged, a run starts, ends or is removed:
+# the latest run, the number of runs, the newest row ids and the sketch
+# counts of the latest run (they grow without new row ids). Unlike
+# PRAGMA data_version it means the same in every process and across
+# restarts, so cached results can be shared and persisted
+FINGERPRINT_SQL = (
+    "SELECT id, started_at, finished_at, (SELECT COUNT(*) FROM test_run),"
+    " (SELECT MAX(rowid) FROM test), (SELECT MAX(rowid) FROM server_log),"
+    " (SELECT MAX(rowid) FROM server_stats),"
+    " (SELECT MAX(rowid) FROM soak_series),"
+    " (SELECT MAX(rowid) FROM server_metrics),"
+    " (SELECT SUM(count) FROM latency_hist WHERE run_id = test_run.id)"
+    " FROM test_run ORDER BY id DESC LIMIT 1"
+)
+
+
+def data_fingerprint(db_name: str=DB_NAME) -> tuple | None:
+    '''Fingerprint of the data in db_name, None if it has no schema yet.'''
+    try:
+        row = read_connection(db_name).execute(FINGERPRINT_SQL).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row or ()
+
+
+def cached_query(
+ kind: str, query: str, db_name: str, compute: Callable[[], T]) -> T:
+    '''compute() through the result cache: reused while the data
+    fingerprint of db_name is unchanged.'''
+    fingerprint = data_fingerprint(db_name)
+    if fingerprint is None:
+        return compute()
+    return result_cache.get_or_compute(kind, db_name, query, fingerprint,
+                                       compute)
+
+
+STREAM_ARRAYSIZE = 1000  # rows per fetchmany() in 'stream' mode
+
+
+def _stream_rows(cur: sqlite3.Cursor) -> Iterator[list[tuple]]:
+    '''Yield cur.arraysize rows at a time.'''
+    while rows := cur.fetchmany():
+        yield rows
+
+
 def get_from_base(
  query: str='', mode: str='full table',\
- db_name: str=DB_NAME) -> list[str] | tuple[list[str], list[tuple[Any, ...]]]:
+ db_name: str=DB_NAME, arraysize: int=STREAM_ARRAYSIZE, cache: bool=True
+ ) -> list[str] | tuple[list[str], list[tuple[Any, ...]]] |\
+ tuple[list[str], Iterator[list[tuple[Any, ...]]]]:
+    '''
+    Run a query on the cached read connection of db_name. 'full table'
+    returns (columns, all rows), from the result cache while the data is
+    unchanged unless cache=False; 'stream' returns (columns, generator of row
+    chunks of `arraysize` rows): the query runs right away, rows are fetched
+    as the generator is consumed (in the calling thread) and never held all
+    at once; 'templates' returns the column names of the queried table.
+    '''
     if not query:
-        query = get_query('basic_stats')
-    with sqlite3.connect(DB_NAME) as conn:
+        query = get_query('basic_stats')[1]
+    if mode == 'full table' and cache:
+        return cached_query('rows', query, db_name, lambda: get_from_base(
+            query, db_name=db_name, cache=False))
+    conn = read_connection(db_name)
 
-        if mode == 'templates':
-            table_name = extract_table_name(query)
-            if not table_name:
-                print('Table name not exists')
+    if mode == 'templates':
+        table_name = extract_table_name(query)
+        if not table_name:
+            print('Table name not exists')
             return []
-            cur = conn.execute(f"PRAGMA table_info({table_name})")
-            return [row[1] for row in cur.fetchall()]
-        cur = conn.cursor()
-        cur.execute(query)
-
-        columns = [desc[0] for desc in cur.description]
-        result = cur.fetchall()
-        return columns, result
+        cur = conn.execute(f"PRAGMA table_info({table_name})")
+        return [row[1] for row in cur.fetchall()]
+    cur = conn.execute(query)
+    columns = [desc[0] for desc in cur.description]
+    if mode == 'stream':
+        cur.arraysize = arraysize
+        return columns, _stream_rows(cur)
+    return columns, cur.fetchall()
@@ -4,11 +4,14 @@ import matplotlib.pyplot as plt
 import numpy as np
 import tkinter as tk
 
-from db_utils import get_from_base
+from aggregation import aggregate_series, grouped_aggregate,\
+ load_metric_columns, sketch_aggregate, sketch_series
+from columnar_export import export_aggregate, export_series
+from db_utils import QueryPager, get_from_base
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg,\
  NavigationToolbar2Tk
 from query_loader import get_query
-from tkinter import ttk, TclError
+from virtual_table import VirtualTable
 
 
 def make_table(query_name: str) -> None:
@@ -21,21 +24,22 @@ def make_table(query_name: str) -> None:
 
     Behavior:
         - Retrieves SQL query and metadata from templates.
-        - Executes the query and fetches columns and rows.
-        - Opens a new Tkinter Toplevel window with a Treeview widget.
-        - Displays the results with headers centered.
-        - Inserts rows incrementally in batches of 50 to keep UI responsive.
-        - Handles window closure gracefully if user closes before all rows loaded.
+        - Materializes the result in a SQLite temp table (QueryPager).
+        - Opens a new Tkinter Toplevel window with a virtual table: only the
+          visible rows exist as Treeview items and are paged from SQLite
+          while scrolling, so any number of rows opens at once.
+        - Displays the results with headers centered, clicking a header
+          sorts by that column in SQL.
+        - Releases the database connection when the window is closed.
     """
     # Fetch title, query text, and optional custom headers for the template
     title_, query, custom_headers = get_query(query_name)
-    # Execute query and retrieve columns and rows from database
-    columns, rows = get_from_base(query)
-
     if not query:
         print(f"Query '{query_name}' not found.")
         return
     print('Processing...\n')
+    pager = QueryPager(query)
+    columns = pager.columns
     # Use custom headers if provided and length matches columns,
     # otherwise use columns
     headers = custom_headers if custom_headers and\
@@ -43,38 +47,18 @@ def make_table(query_name: str) -> None:
 
     # Create a new top-level window for the table
     root = tk.Toplevel()
-    root.title(title_)
-    tree = ttk.Treeview(root, columns=columns, show="headings")
-    tree.pack(fill=tk.BOTH, expand=True)
-
-    # Configure columns: set heading text and center alignment
-    for col, head in zip(columns, headers):
-        tree.heading(col, text=head, anchor="center")
-        tree.column(col, anchor="center")
-
-    def insert_rows(index=0):
-        """
-        Insert rows into the Treeview widget incrementally in batches.
-
-        Args:
-            index (int): Starting index of rows to insert.
-        """
-        try:
-            for _ in range(50):  # Insert 50 rows per call to avoid freezing UI
-                if index >= len(rows):
-                    return
-                tree.insert("", "end", values=rows[index])
-                index += 1
-            # Schedule next batch insertion after 1 millisecond
-            root.after(1, insert_rows, index)
-        except TclError:
-            print("\033[3;31mWinow closed manually before table complete")
-
-    # Start inserting rows after the window is ready
-    root.after(0, insert_rows)
-
-
-def plot_line_multi_metric(mode='avg'):
+    root.title(f"{title_} ({pager.total} rows)")
+    VirtualTable(root, pager, headers)
+
+    def release(event: tk.Event) -> None:
+        if event.widget is root:
+            pager.close()
+
+    root.bind("<Destroy>", release)
+
+
+def plot_line_multi_metric(mode='avg', query_name='raw_stats', source='raw',
+                           export_path=None):
     """
     Plot line charts with multiple metrics aggregated by groups.
 
@@ -83,6 +67,12 @@ def plot_line_multi_metric(mode='avg'):
             - 'avg' (default): mean
             - 'median': median
             - 'pNN': percentile, where NN is an integer (e.g., 'p90' for 90th percentile)
+        query_name (str): Template supplying the rows, 'raw_stats' (wall clock
+            seconds) or 'raw_stats_ns' (monotonic nanoseconds).
+        source (str): 'raw' aggregates the rows of the test table,
+            'sketch' reads the latency histograms written at ingest time,
+            'export' the memory-mapped columns of a run exported by
+            columnar_export.export_run (directory in export_path).
 
     This function fetches data from the database, groups it by the first column,
     aggregates metrics by X values, and plots the results using matplotlib embedded in a Tkinter window.
@@ -93,21 +83,22 @@ def plot_line_multi_metric(mode='avg'):
     - x-axis value (numeric)
     - one or more numeric metrics to aggregate and plot
     """
-    title_, query, headers_ = get_query('raw_stats')
-    columns, rows = get_from_base(query)
+    title_, query, headers_ = get_query(query_name)
+    # Rows are loaded as NumPy columns in one pass and every
+    # (group, clients_total) bucket is aggregated at once
+    if source == 'sketch':
+        columns, series = sketch_series(query, mode)
+    elif source == 'export':
+        columns, series = export_series(export_path, query, mode)
+    else:
+        columns, series = aggregate_series(query, mode)
 
     if len(columns) < 3:
         print("Minimum 3 columns required: group, x, [y1, y2...]")
         return
     print('Processing...\n')
-
-    # Organize data by group: {group: [(x, (metric1, metric2, ...)), ...]}
-    data = {}
-    for row in rows:
-        group = row[0]
-        x = row[1]
-        metrics = row[2:]
-        data.setdefault(group, []).append((x, metrics))
+    if len(headers_) != len(columns):
+        headers_ = columns
 
     # Create the main Tkinter window
     win = tk.Tk()
@@ -124,33 +115,9 @@ def plot_line_multi_metric(mode='avg'):
     fig, ax = plt.subplots(figsize=(fig_width, 5))
 
     # Plot each group's aggregated metrics
-    for group, points in data.items():
-        grouped: dict[int, list[tuple[float, ...]]] = {}
-
-        # Creating X axis by clients_total
-        for x_val, metric_tuple in points:
-            grouped.setdefault(x_val, []).append(metric_tuple)
-
-        # For each metric column, calculate aggregation per X and plot
-        for i, metric_name in enumerate(headers_[2:]):
-            x_vals = []
-            y_vals = []
-
-            for x, metric_list in sorted(grouped.items()):
-                vals = [m[i] for m in metric_list]
-                if not vals:
-                    continue
-                if mode == 'median':
-                    y = np.median(vals)
-                elif mode.startswith('p') and mode[1:].isdigit():
-                    y = np.percentile(vals, int(mode[1:]))
-                else:
-                    y = np.mean(vals)
-
-                x_vals.append(x)
-                y_vals.append(y)
-
-        ax.plot(x_vals, y_vals, marker='o', label=f"{group} – {metric_name}")
+    for group, metric_series in series.items():
+        for metric_name, (x_vals, y_vals) in zip(headers_[2:], metric_series):
+            ax.plot(x_vals, y_vals, marker='o', label=f"{group} – {metric_name}")
 
     # Set X-axis ticks and limits to avoid empty space before first tick
     ax.set_xticks(list(range(64, 4097, 64)))
@@ -223,8 +190,8 @@ def show_client_success_diagram(server_type: str,
     for a given server.
 
     Each bar shows counts of:
-    - full_success (2 successful exchanges)
-    - half_success (1 success)
+    - full_success (every exchange successful)
+    - half_success (some exchanges successful)
     - fail (calculated as total - full - half)
 
     Args:
@@ -259,9 +226,9 @@ def show_client_success_diagram(server_type: str,
 
     # Create matplotlib figure
     fig, ax = plt.subplots(figsize=(fig_width, 5))
-    ax.bar(x, fail, label="Fail (0)", color="red")
-    ax.bar(x, half, bottom=fail, label="Partial (1)", color="gold")
-    ax.bar(x, full, bottom=[f + h for f, h in zip(fail, half)], label="Success (2)", color="green")
+    ax.bar(x, fail, label="Fail", color="red")
+    ax.bar(x, half, bottom=fail, label="Partial", color="gold")
+    ax.bar(x, full, bottom=[f + h for f, h in zip(fail, half)], label="Success", color="green")
 
     ax.set_xticks(x)
     ax.set_xticklabels(labels, rotation=45)
@@ -321,9 +288,10 @@ def prepare_max_wave_summary() -> dict[str, tuple[int, str | None]]:
 
     try:
         # Get all fatal errors
-        query2 = "SELECT server_type, message FROM server_log"
-        columns2, rows2 = get_from_base(query2)
-        errors = {row[0]: row[1] for row in rows2}
+        query2 = ("SELECT server_type, message FROM server_log "
+                  "JOIN latest_run USING (server_type, run_id)")
+        columns2, chunks2 = get_from_base(query2, 'stream')
+        errors = {row[0]: row[1] for rows2 in chunks2 for row in rows2}
     except Exception as ex:
         print("Error while reading server_log:", ex)
         errors = {}
@@ -412,7 +380,8 @@ def plot_max_clients_per_server() -> None:
     win.mainloop()
 
 
-def plot_avg_response_per_server(mode: str = 'mean') -> None:
+def plot_avg_response_per_server(mode: str = 'mean', source: str = 'raw',
+                                 export_path: str | None = None) -> None:
     """
     Display a bar chart comparing average response time per server_type.
 
@@ -421,34 +390,33 @@ def plot_avg_response_per_server(mode: str = 'mean') -> None:
             - 'mean': average
             - 'median': median
             - 'pNN': percentile (e.g., 'p90', 'p99')
+        source (str): 'raw' rows of the test table, 'sketch' latency
+            histograms or 'export' files of a run (directory in export_path).
     """
     try:
-        title_, query, headers_ = get_query('raw_stats')
-        columns, rows = get_from_base(query)
+        if source == 'sketch':
+            labels, codes, _, aggregated = sketch_aggregate(
+                't_response', mode, per_x=False)
+        elif source == 'export':
+            labels, codes, _, aggregated = export_aggregate(
+                export_path, 't_response', mode, per_x=False)
+        else:
+            title_, query, headers_ = get_query('raw_stats')
+            columns, labels, groups, _, metrics = load_metric_columns(query)
     except Exception as ex:
         print("Error fetching data:", ex)
         return
 
     try:
-        # Group response times by server_type
-        data: dict[str, list[float]] = {}
-        for row in rows:
-            server_type = row[0]
-            t_response = row[3]
-            if t_response is not None:
-                data.setdefault(server_type, []).append(t_response)
-
-        # Aggregate according to mode
-        summary: dict[str, float] = {}
-        for srv, values in data.items():
-            if not values:
-                continue
-            if mode == 'median':
-                summary[srv] = float(np.median(values))
-            elif mode.startswith('p') and mode[1:].isdigit():
-                summary[srv] = float(np.percentile(values, int(mode[1:])))
-            else:
-                summary[srv] = float(np.mean(values))
+        if source == 'raw':
+            # Aggregate t_response (4th column) per server_type: one
+            # bucket per group, so every x is treated as the same
+            codes, _, aggregated = grouped_aggregate(
+                groups, np.zeros(len(groups), dtype=np.int64),
+                metrics[:, 1], mode)
+        summary: dict[str, float] = {
+            labels[code]: float(value)
+            for code, value in zip(codes, aggregated)}
 
         # Prepare data
         labels = list(summary.keys())
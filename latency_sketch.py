@@ -0,0 +1,85 @@
+# latency_sketch.py
+
+from collections import Counter
+from types_common import LogData
+
+
+# HDR-style log-linear buckets over integer nanoseconds: values below
+# 2 ** (SUB_BITS + 1) get a bucket of their own, above that every power of
+# two is split into 2 ** SUB_BITS equal buckets, so a bucket's width never
+# exceeds 1 / 128 (< 0.8 %) of its values. Counts of equal buckets simply
+# add up, which makes the sketches mergeable across batches, writers and
+# processes.
+SUB_BITS = 7
+EXACT_LIMIT = 1 << (SUB_BITS + 1)
+
+# Metrics kept as sketches and the factor turning them into nanoseconds
+SKETCH_METRICS: dict[str, float] = {
+    't_send_success': 1e9,
+    't_response': 1e9,
+    'connect_ns': 1,
+    'rtt_ns': 1,
+    'server_ns': 1,
+    'co_rtt_ns': 1,
+}
+
+UPSERT_SQL = (
+    "INSERT INTO latency_hist ("
+    "run_id, server_type, clients_total, metric, bucket, count"
+    ") VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(run_id, server_type, clients_total, metric, bucket) "
+    "DO UPDATE SET count = count + excluded.count"
+)
+
+
+def bucket_of(value: int) -> int:
+    '''Bucket index of a non-negative integer value.'''
+    if value < EXACT_LIMIT:
+        return value
+    shift = value.bit_length() - (SUB_BITS + 1)
+    return (shift << SUB_BITS) + (value >> shift)
+
+
+def bucket_bounds(bucket: int) -> tuple[int, int]:
+    '''Smallest and largest value falling into the bucket.'''
+    if bucket < EXACT_LIMIT:
+        return bucket, bucket
+    shift = (bucket >> SUB_BITS) - 1
+    mantissa = bucket - (shift << SUB_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class LatencySketch:
+    """
+    Histogram counts of one test run accumulated between two flushes, keyed
+    by (server_type, clients_total, metric, bucket).
+    """
+    __slots__ = ('run_id', 'counts')
+
+    def __init__(self, run_id: int) -> None:
+        self.run_id = run_id
+        self.counts: Counter[tuple[str, int, str, int]] = Counter()
+
+    def add_row(self, row: LogData) -> None:
+        server_type = row['server_type']
+        clients_total = row['clients_total']
+        for metric, scale in SKETCH_METRICS.items():
+            value = row[metric]  # type: ignore[literal-required]
+            if value is None:
+                continue
+            # Wall clock differences may be slightly negative: clamp to 0
+            self.counts[server_type, clients_total, metric,
+                        bucket_of(max(0, round(value * scale)))] += 1
+
+    def flush(self, cursor) -> None:
+        '''Merge the accumulated counts into latency_hist. They are kept
+        until clear(), so a flush rolled back with its transaction can be
+        repeated.'''
+        if self.counts:
+            cursor.executemany(
+                UPSERT_SQL,
+                ((self.run_id, *key, count)
+                 for key, count in self.counts.items()))
+
+    def clear(self) -> None:
+        self.counts.clear()
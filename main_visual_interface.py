@@ -1,15 +1,17 @@
 # main_visual_interface.py
 import multiprocessing
 import server_client_maker as scm
+import sqlite3
 import threading
 import time
 import tkinter as tk
 
-from db_utils import get_from_base
+from columnar_export import export_run
+from db_utils import archive_runs, delete_runs, get_from_base, init_db
 from graph_matplotlib_tkinter import make_table, plot_line_multi_metric,\
  show_client_success_diagram, group_summary_by_server,\
  plot_max_clients_per_server, plot_avg_response_per_server
-from query_loader import choose_template, get_query
+from query_loader import choose_template, get_query, template_error
 
 
 def close_windows():
@@ -22,6 +24,79 @@ def close_windows():
     root.quit()
 
 
+def choose_source() -> tuple[str, str | None]:
+    """
+    Ask whether a plot aggregates raw rows, the latency sketches or the
+    files of an exported run. Returns the source and the export directory.
+    """
+    source = input("Choose data source:\n"
+     "1. Latency sketches (fast, ~1% precision)\n"
+     "2. Exported run files (memory-mapped, one run)\n"
+     "Any other = Raw rows\n> ").strip()
+    if source == '1':
+        return 'sketch', None
+    if source == '2':
+        return 'export', input("Export directory? ").strip()
+    return 'raw', None
+
+
+def template_ok(name: str) -> bool:
+    """
+    Report a template whose SQL does not compile against the database,
+    instead of letting the table or plot process using it crash.
+    """
+    error = template_error(name)
+    if error:
+        print(f'Template "{name}" cannot run: {error}\n'
+              'Fix it in the template editor (menu 2).')
+    return not error
+
+
+def manage_runs() -> None:
+    """
+    List the stored test runs and retire the chosen ones: delete them or
+    move them into an archive database file. Errors are reported, not
+    raised, so the console keeps running.
+    """
+    init_db()  # the database may predate some of the run tables
+    _, query, headers_ = get_query('test_runs')
+    columns, runs = get_from_base(query)
+    known = {run[0] for run in runs}
+    for run in runs:
+        print(f'{run[0]:>4}. {run[1]}  {run[2]}  {run[3]}, '
+              f'max wave {run[11]}, errors {run[13]}')
+    action = input("1. Archive runs\n"
+     "2. Delete runs\n"
+     "3. Export a run to columnar files\n"
+     "Any other = Cancel\n> ").strip()
+    if action not in ('1', '2', '3'):
+        return
+    run_ids = [int(x) for x in input("Run ids (space separated)? ").split()
+               if x.isdigit()]
+    unknown = [run_id for run_id in run_ids if run_id not in known]
+    if unknown:
+        print(f'No test runs {unknown}, skipped')
+        run_ids = [run_id for run_id in run_ids if run_id in known]
+    if not run_ids:
+        return
+    try:
+        if action == '3':
+            for run_id in run_ids:
+                try:
+                    print(f'Run {run_id} exported to {export_run(run_id)}')
+                except (ValueError, OSError, sqlite3.Error) as ex:
+                    print(f'Run {run_id} not exported: {ex}')
+        elif action == '1':
+            archive = input("Archive file? (Enter - archive.sqlite) ").strip()
+            archive_runs(run_ids, archive or 'archive.sqlite')
+            print(f'Archived runs {run_ids}')
+        else:
+            delete_runs(run_ids)
+            print(f'Deleted runs {run_ids}')
+    except (ValueError, OSError, sqlite3.Error) as ex:
+        print(f'Runs {run_ids}: {ex}')
+
+
 def main():
     """
     Main interactive console interface loop.
@@ -34,6 +109,7 @@ def main():
         print("2. Show table by SQL query")
         print("3. Make graph")
         print('4. Show diagram')
+        print("5. Manage test runs")
         print("0. Exit program")
         choice = input("You choice:\n ").strip()
 
@@ -61,9 +137,19 @@ def main():
                 mode = 'p99'
             else:
                 mode = 'avg'
+            timing = input("Choose timing source:\n"
+             "1. Monotonic nanoseconds (RTT, connect, server)\n"
+             "2. Open-loop latency from the intended send time vs RTT (ns)\n"
+             "Any other = Wall clock seconds\n> ").strip()
+            query_name = {'1': 'raw_stats_ns', '2': 'open_loop_ns'}.get(
+             timing, 'raw_stats')
+            source, export_path = choose_source()
+            if not template_ok(query_name):
+                continue
             # Run plotting in a separate process to avoid blocking
             multiprocessing.Process(target=plot_line_multi_metric,
-             args=(mode,), daemon=True).start()
+             args=(mode, query_name, source, export_path),
+             daemon=True).start()
             time.sleep(2)
         elif choice == '4':
             while True:
@@ -77,6 +163,8 @@ def main():
 \n \033[1mAny other key -- Cancel\033[0m\n')
                 if dia_type:
                     if dia_type == '1':
+                        if not template_ok('server_max_wave'):
+                            continue
                         try:
                             multiprocessing.Process(
                              target=plot_max_clients_per_server,
@@ -84,6 +172,8 @@ def main():
                         except Exception:
                             raise
                     elif dia_type == '2':
+                        if not template_ok('client_success_summary'):
+                            continue
                         _, query, headers_ =\
                          get_query('client_success_summary')
                         raw_summary: list[tuple[str, int, int, int]] =\
@@ -120,14 +210,20 @@ def main():
                             mode = 'p99'
                         else:
                             mode = 'avg'
+                        source, export_path = choose_source()
+                        if not template_ok('raw_stats'):
+                            continue
                         # Run plotting in a separate process to avoid blocking
                         multiprocessing.Process(
                          target=plot_avg_response_per_server,
-                         args=(mode,), daemon=True).start()
+                         args=(mode, source, export_path),
+                         daemon=True).start()
                         time.sleep(2)
                     else:
                         print('Cancelled')
                         break
+        elif choice == '5':
+            manage_runs()
         elif choice == '0':
             # Close all additional windows and quit main loop
             for win in root.winfo_children():
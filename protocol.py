@@ -0,0 +1,53 @@
+# protocol.py
+
+import struct
+import time
+
+from typing import TypedDict
+
+
+# Frames are self-describing: every frame starts with its total length, so
+# servers answer any payload size and any number of pipelined requests
+# without being told the client settings.
+# Request: frame length, exchange number (mark) and an arbitrary float
+REQUEST = struct.Struct('!Ihd')
+# The mark is a signed 16-bit field: exchange numbers past 32767 wrap,
+# rows keep the full number in send_id
+MARK_MASK = 0x7fff
+# Response: frame length, echoed mark, server wall clock time (kept for the
+# legacy t_server_response / t_response columns) and the nanoseconds the
+# server spent between reading the request and answering it
+RESPONSE = struct.Struct('!Ihdq')
+
+MIN_PAYLOAD = REQUEST.size
+MAX_PAYLOAD = 1 << 20  # 1 MB
+
+
+class ProtocolConfig(TypedDict):
+    payload_size: int  # request frame size in bytes, echoed in the response
+    exchanges: int  # request/response pairs per connection
+    pipeline_depth: int  # requests in flight before reading a response
+
+
+DEFAULT_PROTOCOL: ProtocolConfig = {
+    'payload_size': MIN_PAYLOAD,
+    'exchanges': 2,
+    'pipeline_depth': 1,
+}
+
+
+def request_frame(payload_size: int) -> bytearray:
+    '''Zero-filled request buffer of payload_size bytes (at least the
+    header). Fill the header with REQUEST.pack_into before each send.
+    '''
+    return bytearray(max(payload_size, REQUEST.size))
+
+
+def response_frame(mark: int, frame_len: int, server_ns: int) -> bytes:
+    '''Build the response to a request of frame_len bytes: the same size,
+    but never shorter than the response header.
+    '''
+    size = max(frame_len, RESPONSE.size)
+    return RESPONSE.pack(size, mark, time.time(), server_ns)\
+        + bytes(size - RESPONSE.size)
+
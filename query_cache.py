@@ -0,0 +1,158 @@
+# query_cache.py
+
+import hashlib
+import numpy as np
+import os
+import pickle
+import sys
+import threading
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from pathlib import Path
+from typing import Any, TypeVar
+
+
+T = TypeVar('T')
+
+CACHE_BYTES = 256 << 20  # in-memory results, least recently used go first
+PERSIST_CACHE = True  # also keep results on disk, shared across processes
+CACHE_DIR = Path(".query_cache")
+DISK_CACHE_BYTES = 1 << 30  # oldest files are removed above this size
+
+
+def size_of(value: Any) -> int:
+    '''Approximate memory size of a cached result: exact for NumPy arrays,
+    estimated from a sample for long lists of rows.'''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        if len(value) > 100:
+            step = len(value) // 100
+            sample = value[::step][:100]
+            return sys.getsizeof(value)\
+                + sum(map(size_of, sample)) * len(value) // len(sample)
+        return sys.getsizeof(value) + sum(map(size_of, value))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            size_of(k) + size_of(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    LRU cache of query results bounded by their total size in bytes.
+
+    Entries are keyed by what was computed (kind, database, SQL text) and
+    carry the data fingerprint they were computed for: a lookup with another
+    fingerprint is a miss, so a result is reused only while the data it
+    comes from is unchanged. With persist=True results also go to CACHE_DIR
+    (one pickle file per key, the fingerprint stored ahead of the value), so
+    short-lived plotting processes share them. A result larger than the
+    whole memory or disk budget is not kept there at all.
+    """
+
+    def __init__(self, max_bytes: int=CACHE_BYTES, persist: bool=PERSIST_CACHE,
+                 cache_dir: Path=CACHE_DIR,
+                 max_disk_bytes: int=DISK_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.persist = persist
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: OrderedDict[str, tuple[Hashable, Any, int]] =\
+            OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key_of(kind: str, db_name: str, sql: str) -> str:
+        return hashlib.sha256(
+            f'{kind}\0{os.path.realpath(db_name)}\0{sql}'.encode()
+            ).hexdigest()
+
+    def get_or_compute(self, kind: str, db_name: str, sql: str,
+                       fingerprint: Hashable, compute: Callable[[], T]) -> T:
+        key = self.key_of(kind, db_name, sql)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self.entries.move_to_end(key)
+                return entry[1]
+        if self.persist:
+            found, value = self._load(key, fingerprint)
+            if found:
+                self._remember(key, fingerprint, value)
+                return value
+        value = compute()
+        size = size_of(value)
+        self._remember(key, fingerprint, value, size)
+        # Written only to be evicted at once: skip the pickling
+        if self.persist and size <= self.max_disk_bytes:
+            self._store(key, fingerprint, value)
+        return value
+
+    def _remember(self, key: str, fingerprint: Hashable, value: Any,
+                  size: int | None=None) -> None:
+        if size is None:
+            size = size_of(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (fingerprint, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def _load(self, key: str, fingerprint: Hashable) -> tuple[bool, Any]:
+        path = self.cache_dir / f'{key}.pickle'
+        try:
+            with path.open('rb') as f:
+                # The header alone tells a stale file, without the value
+                if pickle.load(f) != fingerprint:
+                    return False, None
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        os.utime(path)  # disk eviction goes by last use
+        return True, value
+
+    def _store(self, key: str, fingerprint: Hashable, value: Any) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f'{key}.pickle'
+        # Written aside and renamed: readers never see a partial file
+        tmp = path.with_name(
+            f'{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with tmp.open('wb') as f:
+            pickle.dump(fingerprint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+        # Other processes may be evicting too: vanished files are skipped
+        files = []
+        for file in self.cache_dir.glob('*.pickle'):
+            try:
+                files.append((file.stat(), file))
+            except OSError:
+                continue
+        files.sort(key=lambda item: item[0].st_mtime, reverse=True)
+        total = 0
+        for stat, file in files:
+            total += stat.st_size
+            if total > self.max_disk_bytes:
+                file.unlink(missing_ok=True)
+
+    def clear(self, disk: bool=False) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+        if disk:
+            for file in self.cache_dir.glob('*.pickle'):
+                file.unlink(missing_ok=True)
+
+
+# One cache per process
+result_cache = ResultCache()
@@ -1,19 +1,90 @@
 # query_loader.py
 
 import json
+import os
+import sqlite3
+import threading
+
 from pathlib import Path
 
 TEMPLATE_PATH = Path("query_templates.json")
 
 
+class TemplateRegistry:
+    """
+    Templates of a JSON file, parsed once and parsed again only when the
+    file changes (its mtime or size).
+
+    errors() checks every template with EXPLAIN against the schema of a
+    database, again only when the file or the schema has changed, so bad
+    SQL is reported before a table or plot process runs it.
+    """
+
+    def __init__(self, path: Path=TEMPLATE_PATH) -> None:
+        self.path = path
+        self.stamp: tuple[int, int] | None = None  # mtime_ns, size
+        self.templates: dict[str, dict[str, str]] = {}
+        self.checked: tuple | None = None  # what self.problems was found for
+        self.problems: dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def get(self) -> dict[str, dict[str, str]]:
+        '''The current templates: do not modify, see load_templates.'''
+        with self.lock:
+            try:
+                stat = self.path.stat()
+            except FileNotFoundError:
+                self.stamp, self.templates = None, {}
+                return self.templates
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if stamp != self.stamp:
+                with self.path.open("r", encoding="utf-8") as f:
+                    self.templates = json.load(f)
+                self.stamp = stamp
+            return self.templates
+
+    def errors(self, db_name: str | None=None) -> dict[str, str]:
+        '''
+        Map the name of every template whose SQL does not compile against
+        the schema of db_name to the SQLite error. Nothing is checked while
+        the database does not exist or has no tables yet.
+        '''
+        # db_utils imports this module: import it on first use
+        from db_utils import DB_NAME, read_connection
+        db_name = db_name or DB_NAME
+        templates = self.get()
+        if not os.path.exists(db_name):
+            return {}
+        conn = read_connection(db_name)
+        schema = conn.execute("PRAGMA schema_version").fetchone()[0]
+        if not schema:
+            return {}
+        with self.lock:
+            checked = (self.stamp, os.path.realpath(db_name), schema)
+            if checked != self.checked:
+                self.problems = {}
+                for name, entry in templates.items():
+                    try:
+                        conn.execute(f'EXPLAIN {entry.get("query", "")}')
+                    except (sqlite3.Error, sqlite3.Warning) as e:
+                        self.problems[name] = str(e)
+                self.checked = checked
+            return self.problems
+
+
+registry = TemplateRegistry()
+
+
 def load_templates() -> dict[str, dict[str, str]] | dict:
     '''Load SQL query templates from the JSON file. Returns an empty dictionary
-    if the file does not exist.
+    if the file does not exist. The result is a copy, free to edit and save.
     '''
-    if TEMPLATE_PATH.exists():
-        with TEMPLATE_PATH.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    return {name: dict(entry) for name, entry in registry.get().items()}
+
+
+def template_error(name: str, db_name: str | None=None) -> str | None:
+    '''The SQLite error of a template that does not compile, else None.'''
+    return registry.errors(db_name).get(name)
 
 
 def save_templates(templates: dict[str, dict[str, str]]) -> None:
@@ -26,8 +97,7 @@ def get_query(name: str) -> tuple[str, str, list[str]]:
     '''Retrieve the description, SQL text, and optional headers
     for a given template name.
     '''
-    templates = load_templates()
-    entry = templates.get(name)
+    entry = registry.get().get(name)
     if entry:
         return entry.get("description", ""), entry.get("query", ""),\
             entry.get("headers", [])
@@ -39,10 +109,14 @@ def choose_template() -> str | None:
     Launch an interactive menu to select, add, edit, or delete SQL query
     templates. Returns the name of the selected template or None on exit.'''
     while True:
+        name = None
         templates = list_templates()
+        errors = registry.errors()
         print("\nAvaiable query templates:")
-        for i, (name, desc) in enumerate(templates.items(), start=1):
-            print(f"{i}. {name} – {desc}")
+        for i, (template, desc) in enumerate(templates.items(), start=1):
+            print(f"{i}. {template} – {desc}")
+            if template in errors:
+                print(f"\033[31m   broken: {errors[template]}\033[0m")
         print('0. Default query (basic_stats)')
         print('\033[2;36ma - add/edit template')
         print('d - delete template\033[0m')
@@ -66,13 +140,15 @@ def choose_template() -> str | None:
 
             if not name:
                 continue
+            if name in errors:
+                print(f'"{name}" cannot run: {errors[name]}')
+                continue
             return name
 
 
 def list_templates() -> dict[str, str]:
     '''Return a dictionary of template names and their descriptions.'''
-    templates = load_templates()
-    return {key: val["description"] for key, val in templates.items()}
+    return {key: val["description"] for key, val in registry.get().items()}
 
 
 def add_template() -> None:
@@ -106,6 +182,8 @@ def add_template() -> None:
     }
     save_templates(templates)
     print('Query template added\n')
+    if error := template_error(name):
+        print(f'Warning, the query does not compile: {error}\n')
     return None
 
 
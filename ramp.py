@@ -0,0 +1,145 @@
+# ramp.py
+
+import multiprocessing
+
+from collections.abc import Iterator
+from latency_sketch import bucket_bounds, bucket_of
+from types_common import LogDict, LogQueue
+
+
+WAVE_STEP = 64  # first wave, linear step and bisection resolution
+MAX_WAVE = 4096
+MAX_ERROR_RATE = 0.01  # default failure threshold of the adaptive ramp
+
+# RTT histogram of a wave in latency_sketch buckets, up to ~18 minutes
+RTT_BUCKETS = bucket_of(1 << 40) + 1
+
+
+class Ramp:
+    """
+    Wave sizes of a test suite, chosen from the outcome of the waves run
+    so far (record()).
+
+    The linear ramp steps by WAVE_STEP up to MAX_WAVE and stops at the
+    first failed wave. The adaptive ramp doubles the wave until one fails,
+    then bisects between the largest passed and the smallest failed wave
+    down to WAVE_STEP: a breaking point near 3000 clients is found in about
+    a dozen waves instead of 47.
+    """
+
+    def __init__(self, adaptive: bool=False, start: int=WAVE_STEP,
+                 stop: int=MAX_WAVE, step: int=WAVE_STEP) -> None:
+        self.adaptive = adaptive
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.knee = 0  # largest passed wave
+        self.breaking_point: int | None = None  # smallest failed wave
+        self.failure: str | None = None  # why that wave failed
+
+    def __iter__(self) -> Iterator[int]:
+        while (total := self.next_wave()) is not None:
+            yield total
+
+    def next_wave(self) -> int | None:
+        if self.breaking_point is None:
+            if self.knee >= self.stop:
+                return None
+            if not self.knee:
+                return self.start
+            grown = 2 * self.knee if self.adaptive else self.knee + self.step
+            return min(grown, self.stop)
+        if not self.adaptive:
+            return None
+        middle = (self.knee + self.breaking_point) // 2\
+            // self.step * self.step
+        return middle if middle > self.knee else None
+
+    def record(self, total_clients_quantity: int,
+               failure: str | None) -> None:
+        '''Outcome of a wave: None if it passed, else the reason.'''
+        if failure is None:
+            self.knee = max(self.knee, total_clients_quantity)
+        elif self.breaking_point is None\
+                or total_clients_quantity < self.breaking_point:
+            self.breaking_point = total_clients_quantity
+            self.failure = failure
+
+
+class WaveProbe:
+    """
+    Row and error counts and the RTT histogram (for open-loop rows the
+    latency from the intended send time) of the current wave in shared
+    memory, so load generator processes of a sharded wave feed the same
+    probe. The suite reads it right after the wave: no need to wait for
+    the rows to reach SQLite.
+    """
+
+    def __init__(self) -> None:
+        self.lock = multiprocessing.Lock()
+        self.counts = multiprocessing.Array('q', 2, lock=False)  # rows, errors
+        self.rtt = multiprocessing.Array('q', RTT_BUCKETS, lock=False)
+
+    def add(self, row: LogDict) -> None:
+        # Open-loop rows: the latency from the intended send time
+        rtt_ns = row.get('co_rtt_ns')
+        if rtt_ns is None:
+            rtt_ns = row.get('rtt_ns')
+        with self.lock:
+            self.counts[0] += 1
+            if row.get('error'):
+                self.counts[1] += 1
+            if rtt_ns is not None:
+                self.rtt[min(bucket_of(max(0, rtt_ns)), RTT_BUCKETS - 1)] += 1
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counts[:] = [0] * len(self.counts)
+            self.rtt[:] = [0] * RTT_BUCKETS
+
+    def error_rate(self) -> float:
+        rows, errors = self.counts[:]
+        return errors / rows if rows else 0.0
+
+    def rtt_quantile(self, q: float) -> int | None:
+        '''Upper bound of the bucket holding the q-quantile of RTT, in ns.'''
+        counts = self.rtt[:]
+        rank = q * sum(counts)
+        if not rank:
+            return None
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return bucket_bounds(bucket)[1]
+        return None
+
+    def failure(self, server_alive: bool, max_error_rate: float | None,
+                max_p99_ns: int | None) -> str | None:
+        '''Why the wave failed, None if it passed.'''
+        if not server_alive:
+            return 'server crashed'
+        if max_error_rate is not None\
+                and (rate := self.error_rate()) > max_error_rate:
+            return f'error rate {rate:.1%}'
+        if max_p99_ns is not None:
+            p99 = self.rtt_quantile(0.99)
+            if p99 is not None and p99 > max_p99_ns:
+                return f'p99 rtt {p99 / 1e6:.1f} ms'
+        return None
+
+
+class ProbedQueue:
+    """
+    Log queue handed to the clients of a wave: every row is put into the
+    real queue and client rows also feed the wave probe.
+    """
+
+    def __init__(self, queue: LogQueue, probe: WaveProbe) -> None:
+        self.queue = queue
+        self.probe = probe
+
+    def put(self, row: LogDict) -> None:
+        if row['log_type'] == 'client':
+            self.probe.add(row)
+        self.queue.put(row)
@@ -1,27 +1,67 @@
 # server.py
 
 import asyncio
+import functools
+import multiprocessing
+import os
 import resource
 import select
+import selectors
 import socket
-import struct
 import time
 
-from db_utils import send_to_base
-from multiprocessing.sharedctypes import Synchronized
-from types_common import NamedQueue, LogDict
+from collections.abc import Callable
+from multiprocessing.connection import Connection
+from multiprocessing.sharedctypes import Synchronized, SynchronizedArray
+from protocol import MAX_PAYLOAD, REQUEST, RESPONSE, response_frame
+from server_metrics import ACCEPTED, ACTIVE, BYTES_IN, BYTES_OUT, MESSAGES,\
+ ServerMetrics
+from types_common import LogDict, LogQueue
 
 
 soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
 resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
 
 
+RECV_BUFFER_SIZE = 16384  # initial per-connection buffer, grows for big frames
+# Seconds without an accepted connection or any traffic after which a
+# per-wave server stops (server_unblocked: UNBLOCKED_IDLE_TIMEOUT)
+IDLE_TIMEOUT = 5.0
+# Unsent response bytes at which a connection is no longer read until its
+# peer reads: pipelined clients cannot make the server buffer without bound
+OUTPUT_HIGH_WATER = 1 << 20
+
+# Counters and gauges of this server process: private until the harness
+# passes shared ones (see exposes_metrics)
+metrics = ServerMetrics(shared=False)
+
+
 class ClientConnection:
-    __slots__ = ('sock', 'pocket', '_hash')
+    """
+    Accepted socket with its own preallocated receive buffer.
+
+    recv_into() fills the free tail of the buffer in place, frames are
+    parsed where they lie with struct.unpack_from and consumed by moving
+    the start offset; bytes are moved only when an incomplete frame has to
+    be shifted to the front. Responses are packed into a reusable buffer.
+
+    Responses are sent without blocking: what the socket does not take is
+    kept in pending and written by flush() once the socket is writable, so
+    a client that is still sending its pipeline never stalls the loop.
+    """
+    __slots__ = ('sock', 'buf', 'view', 'start', 'end',
+                 'out', 'out_view', 'pending', 'handled', '_hash')
 
     def __init__(self, sock: socket.socket):
         self.sock = sock
-        self.pocket = bytearray()
+        self.buf = bytearray(RECV_BUFFER_SIZE)
+        self.view = memoryview(self.buf)
+        self.start = 0  # first unparsed byte
+        self.end = 0  # end of received data
+        self.out = bytearray(RESPONSE.size)
+        self.out_view = memoryview(self.out)
+        self.pending = bytearray()  # unsent output
+        self.handled = 0
         self._hash = hash(sock)
 
     def __hash__(self): return self._hash
@@ -32,16 +72,87 @@ class ClientConnection:
     def fileno(self):
         return self.sock.fileno()
 
+    def fill(self) -> int:
+        """recv_into the free tail of the buffer. Returns the number of bytes
+        read, 0 when the peer closed the connection."""
+        if self.end == len(self.buf):
+            self._make_room()
+        received = self.sock.recv_into(self.view[self.end:])
+        self.end += received
+        metrics.add(BYTES_IN, received)
+        return received
+
+    def _make_room(self) -> None:
+        pending = self.end - self.start
+        if self.start:
+            # Shift the incomplete frame to the front (memmove)
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+            return None
+        # A single frame is larger than the whole buffer
+        grown = bytearray(2 * len(self.buf))
+        grown[:pending] = self.view[:pending]
+        self.view.release()
+        self.buf = grown
+        self.view = memoryview(grown)
+
+    def response(self, mark: int, frame_len: int, server_ns: int
+                 ) -> memoryview:
+        """Pack the response to a frame_len request into the reusable
+        output buffer; its zero padding is written only when it grows."""
+        size = max(frame_len, RESPONSE.size)
+        if size > len(self.out):
+            self.out_view.release()
+            self.out = bytearray(size)
+            self.out_view = memoryview(self.out)
+        RESPONSE.pack_into(self.out, 0, size, mark, time.time(), server_ns)
+        return self.out_view[:size]
+
+    def send(self, data: bytes | memoryview) -> None:
+        """Send data after any pending output, keep what does not fit."""
+        if not self.pending:
+            try:
+                sent = self.sock.send(data)
+            except BlockingIOError:
+                sent = 0
+            metrics.add(BYTES_OUT, sent)
+            if sent == len(data):
+                return None
+            data = data[sent:]
+        self.pending += data
+
+    def flush(self) -> int:
+        """Send pending output as far as the socket takes it. Returns the
+        number of bytes sent."""
+        sent_total = 0
+        while self.pending:
+            try:
+                sent = self.sock.send(self.pending)
+            except BlockingIOError:
+                break
+            del self.pending[:sent]
+            sent_total += sent
+        metrics.add(BYTES_OUT, sent_total)
+        return sent_total
+
+    @property
+    def backlogged(self) -> bool:
+        """Too much unsent output: stop reading requests until it drains."""
+        return len(self.pending) >= OUTPUT_HIGH_WATER
+
     def close(self):
         try:
             self.sock.close()
         finally:
-            self.pocket.clear()
+            self.view.release()
+            self.out_view.release()
 
 
-def server_sock() -> socket.socket:
+def server_sock(reuse_port: bool = False) -> socket.socket:
     srv = socket.socket()
     srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     srv.bind(("localhost", 5959))
     srv.listen()
     print('serv_socket created')
@@ -51,7 +162,7 @@ def server_sock() -> socket.socket:
 def accept_conn(
  sck: socket.socket,
  sockets: set[ClientConnection],
- queue_: NamedQueue,
+ queue_: LogQueue,
  clients_total: int,
  SERVER_TYPE: str,
  srv_status: Synchronized,
@@ -66,6 +177,7 @@ def accept_conn(
         # This ensures that a "unit" enters the set with a buffer ready.
         new_client = ClientConnection(conn)
         sockets.add(new_client)
+        metrics.add(ACCEPTED)
 
     except BlockingIOError:
         raise
@@ -84,17 +196,40 @@ def accept_conn(
     return None
 
 
+def answer_frames(conn: ClientConnection, t_received: int) -> None:
+    """Answer every complete request frame in the connection buffer, so
+    pipelined requests are not left waiting for another readiness event.
+    """
+    buf = conn.buf
+    start, end = conn.start, conn.end
+    try:
+        while end - start >= REQUEST.size:
+            frame_len, mark, _ = REQUEST.unpack_from(buf, start)
+            if not REQUEST.size <= frame_len <= MAX_PAYLOAD:
+                raise ValueError(f'malformed frame length {frame_len}')
+            if end - start < frame_len:
+                break
+            start += frame_len
+            conn.send(conn.response(
+             mark, frame_len, time.perf_counter_ns() - t_received))
+            conn.handled += 1
+            metrics.add(MESSAGES)
+    finally:
+        if start == end:
+            start = end = 0  # buffer drained, next recv starts at the front
+        conn.start, conn.end = start, end
+
+
 def send_response(conn: ClientConnection,
-                  queue_: NamedQueue,
+                  queue_: LogQueue,
                   clients_total: int,
                   SERVER_TYPE: str,
                   srv_status: Synchronized) -> bool:
-    # 1. IO Section (Reading)
+    # 1. IO Section (Reading straight into the connection buffer)
     try:
-        data = conn.sock.recv(1024)
-        if not data:
+        if not conn.fill():
             return False
-        conn.pocket.extend(data)
+        t_received = time.perf_counter_ns()
     except socket.error as err:
         if err.errno == 11: # EAGAIN
             return True
@@ -102,21 +237,12 @@ def send_response(conn: ClientConnection,
         return False
 
     # 2. Control Section (Completeness of Message)
-    if len(conn.pocket) < 10:
+    if conn.end - conn.start < REQUEST.size:
         return True
 
     # 3. Logic and Response Section (Processor + Write)
     try:
-        # Extract the packet atomically
-        raw_packet = conn.pocket[:10]
-        del conn.pocket[:10]
-
-        mark = struct.unpack('!hd', raw_packet)[0]
-        response = struct.pack('!hd', mark, time.time())
-
-        # Forwarding 10 bytes at once will not block the thread
-        conn.sock.sendall(response)
-
+        answer_frames(conn, t_received)
     except Exception as ex:
         if is_server_crashed(ex):
             log_server_error(queue_, SERVER_TYPE, clients_total, 'fatal_error', str(ex))
@@ -126,11 +252,23 @@ def send_response(conn: ClientConnection,
     return True
 
 
-def log_server_error(que: NamedQueue,
+def flush_output(conn: ClientConnection) -> bool:
+    """Write the pending output of a writable connection. False when the
+    peer is gone."""
+    try:
+        conn.flush()
+    except OSError:
+        return False
+    return True
+
+
+def log_server_error(que: LogQueue,
                      SERVER_TYPE: str,
                      clients_total: int,
                      error_type: str,
                      message: str) -> None:
+    # Only enqueue: the log writer process owns the database connection,
+    # so a failing server never opens SQLite or spends descriptors on it
     log: LogDict = {
         'log_type': 'server',
         'server_type': SERVER_TYPE,
@@ -139,7 +277,65 @@ def log_server_error(que: NamedQueue,
         'message': message,
         'timestamp': round(time.time(), 6)
     }
-    send_to_base(log)
+    que.put(log)
+
+
+def log_server_stat(que: LogQueue,
+                    SERVER_TYPE: str,
+                    clients_total: int,
+                    metric: str,
+                    value: float) -> None:
+    stat: LogDict = {
+        'log_type': 'stats',
+        'server_type': SERVER_TYPE,
+        'clients_total': clients_total,
+        'metric': metric,
+        'value': value,
+        'timestamp': round(time.time(), 6)
+    }
+    que.put(stat)
+
+
+REPORT_CPU_TIME = True
+
+
+def reports_cpu_time(server_func: Callable[..., None]) -> Callable[..., None]:
+    '''Record the CPU time (user + system) a server burned during its wave,
+    including worker processes it has joined, as the cpu_time stat. Wall
+    clock alone hides a busy-polling server; CPU time makes servers
+    comparable.'''
+    @functools.wraps(server_func)
+    def wrapper(QUE: LogQueue, SERVER_TYPE: str,
+                total_clients_quantity: int, srv_status: Synchronized,
+                *args, **kwargs) -> None:
+        start = os.times()
+        try:
+            return server_func(QUE, SERVER_TYPE, total_clients_quantity,
+                               srv_status, *args, **kwargs)
+        finally:
+            if REPORT_CPU_TIME:
+                end = os.times()
+                cpu_time = sum(end[:4]) - sum(start[:4])
+                print(f'{SERVER_TYPE} cpu time: {cpu_time:.3f} s')
+                log_server_stat(QUE, SERVER_TYPE, total_clients_quantity,
+                                'cpu_time', round(cpu_time, 6))
+    return wrapper
+
+
+def exposes_metrics(server_func: Callable[..., None]) -> Callable[..., None]:
+    '''Let the harness pass shared_metrics=ServerMetrics(...): the server
+    process then counts into its block 0 (server_metrics.py) for the
+    harness to scrape, and clears its active gauge when it stops.'''
+    @functools.wraps(server_func)
+    def wrapper(*args, shared_metrics: ServerMetrics | None = None,
+                **kwargs) -> None:
+        if shared_metrics is not None:
+            metrics.use(shared_metrics)
+        try:
+            return server_func(*args, **kwargs)
+        finally:
+            metrics.set(ACTIVE, 0)
+    return wrapper
 
 
 CRITICAL_SERVER_ERRNOS = {
@@ -159,31 +355,48 @@ def is_server_crashed(ex: BaseException) -> bool:
 
 
 
+@exposes_metrics
+@reports_cpu_time
 def server_select(
- QUE: NamedQueue,
+ QUE: LogQueue,
  SERVER_TYPE: str,
  total_clients_quantity: int,
  srv_status: Synchronized) -> None:
     srv = server_sock()
     print(srv)
     sockets = set((srv,))
+    t_iteration = time.perf_counter_ns()
+    waited = 0
     while sockets and srv_status.value:
         # print(f'{len(sockets) = }')
+        t_iteration = metrics.iteration(t_iteration, waited)
+        metrics.set(ACTIVE, len(sockets) - (srv in sockets))
+        # Backlogged connections are only written to until they drain
+        readers = [sock for sock in sockets
+                   if sock is srv or not sock.backlogged]
+        writers = [sock for sock in sockets
+                   if sock is not srv and sock.pending]
         try:
-            sockets_for_read, _, _ = select.select(sockets, [], [], 5)
+            t_wait = time.perf_counter_ns()
+            sockets_for_read, sockets_for_write, _ =\
+                select.select(readers, writers, [], IDLE_TIMEOUT)
+            waited = time.perf_counter_ns() - t_wait
+            for sock in sockets_for_write:
+                if not flush_output(sock):
+                    sockets.remove(sock)
             for sock in sockets_for_read:
                 if not srv_status.value:
                     break
                 if sock is srv:
                     accept_conn(sock, sockets, QUE,
                                  total_clients_quantity, SERVER_TYPE,
-                                 srv_status)
-                else:
+                                 srv_status, mode='unblocking')
+                elif sock in sockets:
                     if not send_response(
                      sock, QUE,
                      total_clients_quantity, SERVER_TYPE, srv_status):
                         sockets.remove(sock)
-            if not sockets_for_read:
+            if not sockets_for_read and not sockets_for_write:
                 print('No conection spotted')
                 srv.close()
                 sockets.remove(srv)
@@ -205,8 +418,351 @@ def server_select(
     print('Server stopped')
 
 
+def drain_responses(conn: ClientConnection,
+                    queue_: LogQueue,
+                    clients_total: int,
+                    SERVER_TYPE: str,
+                    srv_status: Synchronized) -> bool:
+    '''Edge-triggered counterpart of send_response: read the socket until
+    EAGAIN and answer every complete frame, since no further readiness event
+    is reported for data already buffered in the kernel. Frames are answered
+    after each read, so the buffer is reused instead of growing. A
+    backlogged connection is left unread: the caller drains it again once
+    its output has been flushed.
+    '''
+    while not conn.backlogged:
+        try:
+            received = conn.fill()
+        except BlockingIOError:
+            return True
+        except socket.error as err:
+            log_server_error(queue_, SERVER_TYPE, clients_total, 'recv_error', str(err))
+            return False
+        if not received:
+            return False
+
+        try:
+            answer_frames(conn, time.perf_counter_ns())
+        except Exception as ex:
+            if is_server_crashed(ex):
+                log_server_error(queue_, SERVER_TYPE, clients_total, 'fatal_error', str(ex))
+                srv_status.value = False
+            return False
+    return True
+
+
+# Commands of the control pipe of a persistent server (persistent_epoll),
+# sent as (request number, command, *args) and every one answered with
+# (request number, answer): WAVE_START with the new clients_total,
+# WAVE_STATS and WAVE_END with the stats of the current wave (WAVE_END
+# also starts counting anew), SERVER_STOP with None
+WAVE_START = 'start'
+WAVE_STATS = 'stats'
+WAVE_END = 'end'
+SERVER_STOP = 'stop'
+
+
+def epoll_loop(
+ srv: socket.socket,
+ QUE: LogQueue,
+ SERVER_TYPE: str,
+ total_clients_quantity: int,
+ srv_status: Synchronized,
+ counts: SynchronizedArray | None = None,
+ worker: int = 0,
+ control: Connection | None = None) -> None:
+    """
+    Event loop shared by server_epoll, the server_reuseport workers and
+    persistent_epoll.
+
+    epoll keeps the interest set in the kernel: registration is O(1) per
+    socket, waiting does not rescan every descriptor and there is no
+    FD_SETSIZE (1024) ceiling. Edge-triggered mode is used on Linux,
+    elsewhere selectors.DefaultSelector (kqueue/poll) in level-triggered
+    mode; drain_responses is correct for both. Connections are also
+    watched for writability while they have unsent output.
+
+    Args:
+        srv: Bound listening socket.
+        counts: Optional shared array receiving (accepted, messages) pairs,
+            two slots per worker.
+        worker: Index of this loop's pair of slots in counts.
+        control: Control pipe of a persistent server. The loop then waits
+            for commands instead of stopping after 5 idle seconds, and
+            total_clients_quantity is set by every WAVE_START.
+    """
+    srv.setblocking(False)
+    # A persistent server idles between waves until the next command
+    timeout = IDLE_TIMEOUT if control is None else None
+    if hasattr(select, 'epoll'):
+        poller = select.epoll()
+        read_mask = select.EPOLLIN | select.EPOLLET | select.EPOLLRDHUP
+        write_event = select.EPOLLOUT
+        register = lambda fd: poller.register(fd, read_mask)
+        # Edge-triggered EPOLLOUT is reported only when the send buffer
+        # gets room again, so it stays registered
+        register_conn = lambda fd: poller.register(
+            fd, read_mask | write_event)
+        watch = lambda conn: None
+        unregister = poller.unregister
+        wait = lambda: poller.poll(-1 if timeout is None else timeout)
+    else:
+        poller = selectors.DefaultSelector()
+        write_event = selectors.EVENT_WRITE
+        register = lambda fd: poller.register(fd, selectors.EVENT_READ)
+        register_conn = register
+
+        def watch(conn: ClientConnection) -> None:
+            # Level-triggered: ask for writability only while output is
+            # pending, stop reading while it is backlogged
+            events = (0 if conn.backlogged else selectors.EVENT_READ)\
+                | (write_event if conn.pending else 0)
+            if poller.get_key(conn.fileno()).events != events:
+                poller.modify(conn.fileno(), events)
+
+        unregister = poller.unregister
+        wait = lambda: [(key.fd, ev) for key, ev in poller.select(timeout)]
+
+    srv_fd = srv.fileno()
+    register(srv_fd)
+    control_fd = -1
+    if control is not None:
+        control_fd = control.fileno()
+        register(control_fd)
+    connections: dict[int, ClientConnection] = {}
+    accepted_total = 0
+    messages_total = 0
+    wave_start = os.times()
+
+    def drop(fd: int) -> None:
+        nonlocal messages_total
+        conn = connections.pop(fd, None)
+        if conn is None:
+            return
+        messages_total += conn.handled
+        try:
+            unregister(fd)
+        except (KeyError, ValueError, OSError):
+            pass
+        conn.close()
+
+    def serve(conn: ClientConnection, event: int) -> bool:
+        '''Handle a readiness event of a connection, False to drop it.'''
+        backlogged = conn.backlogged
+        if event & write_event and not flush_output(conn):
+            return False
+        # Once flushed, a backlogged connection has unread requests left
+        # that no new edge will report
+        if event & ~write_event or backlogged and not conn.backlogged:
+            if not drain_responses(
+             conn, QUE, total_clients_quantity, SERVER_TYPE, srv_status):
+                return False
+        watch(conn)
+        return True
+
+    def wave_stats() -> dict[str, int | float]:
+        return {
+            'clients_total': total_clients_quantity,
+            'accepted': accepted_total,
+            'messages': messages_total + sum(
+                conn.handled for conn in connections.values()),
+            'open': len(connections),
+            'cpu_time': round(sum(os.times()[:2]) - sum(wave_start[:2]), 6),
+        }
+
+    def command(message: tuple) -> bool:
+        '''Run one control command, False on SERVER_STOP.'''
+        nonlocal total_clients_quantity, accepted_total, messages_total,\
+            wave_start
+        request_id, name, *args = message
+        answer: object = None
+        if name == WAVE_START:
+            total_clients_quantity = answer = args[0]
+        elif name == WAVE_STATS:
+            answer = wave_stats()
+        elif name == WAVE_END:
+            answer = stats = wave_stats()
+            if REPORT_CPU_TIME:
+                log_server_stat(QUE, SERVER_TYPE, total_clients_quantity,
+                                'cpu_time', stats['cpu_time'])
+            # Connections still open count towards the next wave
+            for conn in connections.values():
+                conn.handled = 0
+            accepted_total = messages_total = 0
+            wave_start = os.times()
+        control.send((request_id, answer))
+        return name != SERVER_STOP
+
+    running = True
+    t_iteration = time.perf_counter_ns()
+    waited = 0
+    while running and srv_status.value:
+        t_iteration = metrics.iteration(t_iteration, waited)
+        metrics.set(ACTIVE, len(connections))
+        try:
+            t_wait = time.perf_counter_ns()
+            events = wait()
+            waited = time.perf_counter_ns() - t_wait
+            if not events:
+                print('No conection spotted')
+                break
+            for fd, event in events:
+                if not (running and srv_status.value):
+                    break
+                if fd == srv_fd:
+                    accepted: set[ClientConnection] = set()
+                    # Edge-triggered: accept the whole pending queue at once
+                    try:
+                        while srv_status.value:
+                            accept_conn(srv, accepted, QUE,
+                                        total_clients_quantity, SERVER_TYPE,
+                                        srv_status, mode='unblocking')
+                    except BlockingIOError:
+                        pass
+                    accepted_total += len(accepted)
+                    for conn in accepted:
+                        connections[conn.fileno()] = conn
+                        register_conn(conn.fileno())
+                elif fd == control_fd:
+                    # Edge-triggered too: run every pending command
+                    while running and control.poll():
+                        running = command(control.recv())
+                elif fd in connections:
+                    if not serve(connections[fd], event):
+                        drop(fd)
+        except EOFError:
+            print('Control pipe closed')
+            break
+        except Exception as ex:
+            if is_server_crashed(ex):
+                log_server_error(
+                 QUE, SERVER_TYPE, total_clients_quantity,
+                 'fatal_error', str(ex))
+                print('\033[31mSERVER CRASHED\033[0m')
+                srv_status.value = False
+                break
+            print(ex)
+            log_server_error(
+             QUE, SERVER_TYPE,
+             total_clients_quantity, 'epoll_error', str(ex))
+            break
+
+    for fd in list(connections):
+        drop(fd)
+    poller.close()
+    if counts is not None:
+        counts[2 * worker] = accepted_total
+        counts[2 * worker + 1] = messages_total
+
+
+@exposes_metrics
+@reports_cpu_time
+def server_epoll(
+ QUE: LogQueue,
+ SERVER_TYPE: str,
+ total_clients_quantity: int,
+ srv_status: Synchronized) -> None:
+    srv = server_sock()
+    epoll_loop(srv, QUE, SERVER_TYPE, total_clients_quantity, srv_status)
+    srv.close()
+    print('Server stopped')
+
+
+@exposes_metrics
+def persistent_epoll(
+ control: Connection,
+ QUE: LogQueue,
+ SERVER_TYPE: str,
+ srv_status: Synchronized) -> None:
+    """
+    server_epoll kept alive for a whole test suite: the listening socket is
+    bound once and waves are delimited by commands on the control pipe
+    (WAVE_START, WAVE_STATS, WAVE_END, SERVER_STOP) instead of a new
+    process and an idle timeout per wave. CPU time is logged per wave.
+    """
+    try:
+        srv = server_sock()
+    except OSError as ex:
+        log_server_error(QUE, SERVER_TYPE, 0, 'bind_error', str(ex))
+        srv_status.value = False
+        control.close()
+        return None
+    epoll_loop(srv, QUE, SERVER_TYPE, 0, srv_status, control=control)
+    srv.close()
+    control.close()
+    print('Server stopped')
+
+
+REUSEPORT_WORKERS = os.cpu_count() or 1
+
+
+def reuseport_worker(
+ QUE: LogQueue,
+ SERVER_TYPE: str,
+ total_clients_quantity: int,
+ srv_status: Synchronized,
+ counts: SynchronizedArray,
+ worker: int,
+ shared_metrics: ServerMetrics | None = None) -> None:
+    # Block 0 belongs to the parent: every worker counts into its own
+    if shared_metrics is not None and worker + 1 < shared_metrics.blocks:
+        metrics.use(shared_metrics, worker + 1)
+    try:
+        srv = server_sock(reuse_port=True)
+    except OSError as ex:
+        log_server_error(
+         QUE, SERVER_TYPE, total_clients_quantity, 'bind_error', str(ex))
+        if is_server_crashed(ex):
+            srv_status.value = False
+        return None
+    epoll_loop(srv, QUE, SERVER_TYPE, total_clients_quantity, srv_status,
+               counts, worker)
+    srv.close()
+    metrics.set(ACTIVE, 0)
+
+
+@exposes_metrics
+@reports_cpu_time
+def server_reuseport(
+ QUE: LogQueue,
+ SERVER_TYPE: str,
+ total_clients_quantity: int,
+ srv_status: Synchronized,
+ workers: int = REUSEPORT_WORKERS) -> None:
+    # Every worker binds its own listening socket to the same address with
+    # SO_REUSEPORT, so the kernel spreads incoming connections between
+    # processes and each event loop runs on its own core and GIL.
+    counts = multiprocessing.Array('q', 2 * workers)
+    pool = [multiprocessing.Process(
+             target=reuseport_worker,
+             args=(QUE, SERVER_TYPE, total_clients_quantity,
+                   srv_status, counts, worker, metrics))
+            for worker in range(workers)]
+    for pr in pool:
+        pr.start()
+    for pr in pool:
+        pr.join()
+
+    for worker in range(workers):
+        print(f'worker {worker}: accepted {counts[2 * worker]},'
+              f' messages {counts[2 * worker + 1]}')
+    print('Server stopped')
+
+
+# Adaptive idle strategy of server_unblocked: spin while traffic is likely
+# to continue, then yield the GIL, then sleep with exponential growth so an
+# idle server stops stealing a core from the clients on the same machine
+SPIN_ITERATIONS = 64
+YIELD_ITERATIONS = 1024
+MIN_IDLE_SLEEP = 0.00001
+MAX_IDLE_SLEEP = 0.001
+UNBLOCKED_IDLE_TIMEOUT = 3.0
+
+
+@exposes_metrics
+@reports_cpu_time
 def server_unblocked(
- QUE: NamedQueue,
+ QUE: LogQueue,
  SERVER_TYPE: str,
  total_clients_quantity: int,
  srv_status: Synchronized) -> None:
@@ -214,26 +770,44 @@ def server_unblocked(
     srv.setblocking(False)
     connections: set[ClientConnection] = set()
     delay: float = 0
+    idle = 0  # consecutive loop iterations without any work done
+    t_iteration = time.perf_counter_ns()
+    waited = 0
 
     while srv_status.value:
+        t_iteration = metrics.iteration(t_iteration, waited)
+        waited = 0
+        metrics.set(ACTIVE, len(connections))
+        busy = False
         try:
             accept_conn(srv, connections, QUE,
                         total_clients_quantity,
                         SERVER_TYPE, srv_status, mode='unblocking')
-            delay = 0
+            busy = True
         except BlockingIOError:
-            if not delay:
-                delay = time.time()
-            if time.time() - delay >= 3:
-                print('No connection spotted')
-                srv.close()
-                break
+            pass
         try:
-            for sock in set(connections):
+            closed = []
+            for sock in connections:
+                handled = sock.handled
+                if sock.pending:
+                    try:
+                        if sock.flush():
+                            busy = True
+                    except OSError:
+                        closed.append(sock)
+                        continue
+                    if sock.backlogged:
+                        continue
                 if not send_response(
                  sock, QUE,
                  total_clients_quantity, SERVER_TYPE, srv_status):
-                    connections.remove(sock)
+                    closed.append(sock)
+                elif sock.handled != handled:
+                    busy = True
+            if closed:
+                busy = True
+                connections.difference_update(closed)
         except Exception as ex:
             if is_server_crashed(ex):
                 log_server_error(
@@ -243,14 +817,36 @@ def server_unblocked(
                 srv_status.value = False
                 break
             raise
-        time.sleep(0)
+
+        if busy:
+            idle = 0
+            delay = 0
+            continue
+        # Stop once nothing was accepted, read or written for a while
+        if not delay:
+            delay = time.time()
+        elif time.time() - delay >= UNBLOCKED_IDLE_TIMEOUT:
+            print('No connection spotted')
+            break
+        idle += 1
+        if idle <= SPIN_ITERATIONS:
+            continue
+        t_wait = time.perf_counter_ns()
+        if idle <= SPIN_ITERATIONS + YIELD_ITERATIONS:
+            time.sleep(0)
+        else:
+            time.sleep(min(MAX_IDLE_SLEEP, MIN_IDLE_SLEEP * 2 **
+                           min(idle - SPIN_ITERATIONS - YIELD_ITERATIONS, 7)))
+        waited = time.perf_counter_ns() - t_wait
 
     srv.close()
     print('Server stopped')
 
 
+@exposes_metrics
+@reports_cpu_time
 def server_mixed(
-    QUE: NamedQueue,
+    QUE: LogQueue,
     SERVER_TYPE: str,
     total_clients_quantity: int,
     srv_status: Synchronized
@@ -258,24 +854,33 @@ def server_mixed(
     srv = server_sock()
     srv.setblocking(False)
 
-    sockets: set[socket.socket] = set()
+    sockets: set[ClientConnection] = set()
     delay: int | float = 0
+    t_iteration = time.perf_counter_ns()
 
     while srv_status.value:
+        # Polls with a zero timeout: the loop never waits
+        t_iteration = metrics.iteration(t_iteration)
+        metrics.set(ACTIVE, len(sockets))
         try:
             accept_conn(srv, sockets, QUE,
-             total_clients_quantity, SERVER_TYPE, srv_status)
+             total_clients_quantity, SERVER_TYPE, srv_status,
+             mode='unblocking')
             delay = 0
         except BlockingIOError:
             if not delay:
                 delay = time.time()
-            if time.time() - delay >= 5:
+            if time.time() - delay >= IDLE_TIMEOUT:
                 print('No connection spotted')
                 srv.close()
                 break
 
+            # Backlogged connections are only written to until they drain
+            readers = [sock for sock in sockets if not sock.backlogged]
+            writers = [sock for sock in sockets if sock.pending]
             try:
-                sockets_for_read, _, _ = select.select(sockets, [], [], 0)
+                sockets_for_read, sockets_for_write, _ =\
+                    select.select(readers, writers, [], 0)
             except Exception as ex:
                 if is_server_crashed(ex):
                     log_server_error(
@@ -290,7 +895,15 @@ def server_mixed(
                     'select_error', str(ex))
                 continue
 
+            if sockets_for_read or sockets_for_write:
+                delay = 0  # the idle timeout counts from the last traffic
+            for sock in sockets_for_write:
+                if not flush_output(sock):
+                    sockets.remove(sock)
+                    sock.close()
             for sock in set(sockets_for_read):
+                if sock not in sockets:
+                    continue
                 if not send_response(sock, QUE,
                  total_clients_quantity, SERVER_TYPE, srv_status):
                     sockets.remove(sock)
@@ -316,21 +929,41 @@ def server_mixed(
     print('Server stopped')
 
 
+ASYNC_HEARTBEAT = 0.01  # seconds, see server_async
+
+
+@exposes_metrics
+@reports_cpu_time
 def server_async(
-    QUE: NamedQueue,
+    QUE: LogQueue,
     SERVER_TYPE: str,
     total_clients_quantity: int,
     srv_status: Synchronized
 ) -> None:
+    last_activity = time.monotonic()  # last accept or answered request
+    # Open connections and the tasks serving them
+    clients: dict[asyncio.StreamWriter, asyncio.Task] = {}
 
     async def handle_client(reader: asyncio.StreamReader,
                             writer: asyncio.StreamWriter) -> None:
+        nonlocal last_activity
+        last_activity = time.monotonic()
+        clients[writer] = asyncio.current_task()
+        metrics.add(ACCEPTED)
+        metrics.add(ACTIVE)
         try:
             while True:
                 try:
-                    data = await reader.read(1024)
+                    data = await reader.readexactly(REQUEST.size)
+                    # Timed from the read, as in the other servers: the
+                    # rest of the frame and the response both count
+                    t_received = time.perf_counter_ns()
+                    frame_len = REQUEST.unpack(data)[0]
+                    if frame_len > REQUEST.size:
+                        await reader.readexactly(frame_len - REQUEST.size)
+                    metrics.add(BYTES_IN, max(frame_len, REQUEST.size))
                 except asyncio.IncompleteReadError:
-                    break  # the client closed the connection abnormally
+                    break  # the client closed the connection
                 except ConnectionResetError:
                     break  # The client has disconnected
                 except Exception as ex:
@@ -339,15 +972,16 @@ def server_async(
                         'recv_error', str(ex))
                     break
 
-                if not data:
-                    break  # the client closed the connection normally
-
                 try:
-                    now = time.time()
-                    mark = struct.unpack('!hd', data)[0]
-                    response = struct.pack('!hd', mark, now)
+                    mark = REQUEST.unpack(data)[1]
+                    response = response_frame(
+                        mark, frame_len,
+                        time.perf_counter_ns() - t_received)
                     writer.write(response)
                     await writer.drain()
+                    metrics.add(BYTES_OUT, len(response))
+                    metrics.add(MESSAGES)
+                    last_activity = time.monotonic()
                 except Exception as ex:
                     log_server_error(
                         QUE, SERVER_TYPE, total_clients_quantity,
@@ -355,12 +989,24 @@ def server_async(
                     break
 
         finally:
+            metrics.add(ACTIVE, -1)
+            clients.pop(writer, None)
             try:
                 writer.close()
                 await writer.wait_closed()
             except Exception:
                 pass
 
+    async def heartbeat() -> None:
+        # An event loop has no iteration of its own to time: a tick every
+        # ASYNC_HEARTBEAT counts how late the loop gets to it as busy time,
+        # so the longest iteration is the worst stall of the loop
+        interval_ns = round(ASYNC_HEARTBEAT * 1e9)
+        t_iteration = time.perf_counter_ns()
+        while True:
+            await asyncio.sleep(ASYNC_HEARTBEAT)
+            t_iteration = metrics.iteration(t_iteration, interval_ns)
+
     async def async_main() -> None:
         try:
             server = await asyncio.start_server(
@@ -372,21 +1018,23 @@ def server_async(
             srv_status.value = False
             return None
 
+        # Referenced so it is not collected; asyncio.run cancels it on exit
+        beat = asyncio.create_task(heartbeat())  # noqa: F841
         async with server:
-            try:
-                await asyncio.wait_for(server.serve_forever(), timeout=5.0)
-            except asyncio.TimeoutError:
-                print('No connection spotted (timeout)')
-            except Exception as ex:
-                if is_server_crashed(ex):
-                    log_server_error(
-                        QUE, SERVER_TYPE, total_clients_quantity,
-                        'fatal_error', str(ex))
-                    srv_status.value = False
-                else:
-                    log_server_error(
-                        QUE, SERVER_TYPE, total_clients_quantity,
-                        'serve_forever_error', str(ex))
+            # start_server is already serving: stop once nothing was
+            # accepted or answered for IDLE_TIMEOUT, however long the
+            # clients keep exchanging
+            while srv_status.value:
+                left = last_activity + IDLE_TIMEOUT - time.monotonic()
+                if left <= 0:
+                    print('No connection spotted (timeout)')
+                    break
+                await asyncio.sleep(left)
+            # Connections still open end through EOF here instead of
+            # being cancelled with the event loop
+            for writer in list(clients):
+                writer.close()
+            await asyncio.gather(*clients.values(), return_exceptions=True)
 
     def runner() -> None:
         try:
@@ -1,26 +1,41 @@
 # server_client_maker.py
 
+import asyncio
+import functools
 import multiprocessing
+import os
+import queue
 import random
 import resource
 import socket
-import struct
 import threading
 import time
 
 from collections.abc import Callable
-from db_utils import init_db, send_to_base
+from db_utils import finish_run, init_db, send_to_base, start_log_writer,\
+ start_run, stop_log_writer
 from graph_matplotlib_tkinter import make_table
-from server import server_sock, server_select,\
- server_unblocked, server_mixed, server_async
-from types_common import LogData, NamedQueue
+from multiprocessing.sharedctypes import Synchronized
+from multiprocessing.synchronize import Barrier
+from protocol import DEFAULT_PROTOCOL, MARK_MASK, MAX_PAYLOAD, MIN_PAYLOAD,\
+ REQUEST, RESPONSE, ProtocolConfig, request_frame
+from ramp import MAX_ERROR_RATE, ProbedQueue, Ramp, WaveProbe
+from server import IDLE_TIMEOUT, REUSEPORT_WORKERS, SERVER_STOP,\
+ UNBLOCKED_IDLE_TIMEOUT, WAVE_END, WAVE_START, persistent_epoll, server_sock, server_select, server_unblocked,\
+ server_mixed, server_async, server_epoll, server_reuseport
+from server_metrics import MetricsScraper, ServerMetrics
+from soak import SOAK_CONNECTIONS, SOAK_SECONDS, SOAK_WINDOW, SoakWindow
+from types_common import LogData, LogQueue, NamedQueue
 
+try:  # optional, faster drop-in event loop
+    import uvloop
+except ImportError:
+    uvloop = None
 
 soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
 resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
 
 address = ("localhost", 5959)
-CNT = 2
 # SERVER_TYPE = ''
 que_first: NamedQueue = NamedQueue('que_first')
 que_next: NamedQueue = NamedQueue('que_next')
@@ -38,21 +53,38 @@ def recv_all(sock, n):
     return data
 
 
-def client_sock(SERVER_TYPE: str,
- total_clients_quantity: int, QUE: NamedQueue) -> None:
-    try:
-        clt = socket.socket()
-        clt.settimeout(2.0)
-    except OSError as er:
-        print(f"!!! UNCAUGHT OSError during client socket creation: {er}")
+def recv_response(sock) -> bytearray | None:
+    # Read one response frame: return its header, drop the padding
+    header = recv_all(sock, RESPONSE.size)
+    if header is None:
         return None
+    rest = RESPONSE.unpack_from(header)[0] - RESPONSE.size
+    if rest > 0 and recv_all(sock, rest) is None:
+        return None
+    return header
 
-    cnt = 0
-    attempts = 3000
-    log_data: LogData = {
+
+async def read_response(reader: asyncio.StreamReader) -> bytes:
+    '''Coroutine counterpart of recv_response: read one response frame,
+    return its header, drop the padding.'''
+    header = await asyncio.wait_for(reader.readexactly(RESPONSE.size), 2.0)
+    rest = RESPONSE.unpack_from(header)[0] - RESPONSE.size
+    if rest > 0:
+        await asyncio.wait_for(reader.readexactly(rest), 2.0)
+    return header
+
+
+def error_text(ex: BaseException) -> str:
+    return ex.args[1] if len(ex.args) > 1 else str(ex) or type(ex).__name__
+
+
+def new_log_data(SERVER_TYPE: str, client_id: int,
+                 total_clients_quantity: int) -> LogData:
+    '''Empty client row of one connection.'''
+    return {
         'log_type': 'client',
         'server_type': SERVER_TYPE,
-        'client_id': threading.current_thread().native_id,
+        'client_id': client_id,
         'clients_total': total_clients_quantity,
         'conn_attempt': None,
         't_send_attempt': None,
@@ -60,25 +92,63 @@ def client_sock(SERVER_TYPE: str,
         't_send_success': None,
         't_server_response': None,
         't_response': None,
+        'connect_ns': None,
+        'rtt_ns': None,
+        'server_ns': None,
+        't_intended': None,
+        'co_rtt_ns': None,
         'error': ''
     }
 
-    def clear_log(log_data: LogData) -> None:
-        log_data.update(
-            {
-                'conn_attempt': None,
-                't_send_attempt': None,
-                'send_id': None,
-                't_send_success': None,
-                't_server_response': None,
-                't_response': None,
-                'error': '',
-            }
-        )
 
+async def connect_with_retries(log_data: LogData, QUE: LogQueue
+ ) -> tuple[asyncio.StreamReader, asyncio.StreamWriter] | None:
+    '''
+    Open a connection like client_sock: up to 3000 attempts, 0.5 ms apart.
+    Sets connect_ns and conn_attempt of log_data; if every attempt failed,
+    logs log_data with the error and returns None.
+    '''
+    attempts = 3000
+    t_connect = time.perf_counter_ns()
+    while attempts:
+        try:
+            streams = await asyncio.wait_for(
+             asyncio.open_connection(*address), 2.0)
+            log_data['connect_ns'] = time.perf_counter_ns() - t_connect
+            log_data['conn_attempt'] = 3001 - attempts
+            return streams
+        except Exception:
+            await asyncio.sleep(.0005)
+            attempts -= 1
+    log_data['error'] = 'Connection attempts is over'
+    QUE.put(log_data)
+    return None
+
+
+def client_sock(SERVER_TYPE: str,
+ total_clients_quantity: int, QUE: LogQueue,
+ protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    try:
+        clt = socket.socket()
+        clt.settimeout(2.0)
+    except OSError as er:
+        print(f"!!! UNCAUGHT OSError during client socket creation: {er}")
+        return None
+
+    exchanges = protocol['exchanges']
+    depth = protocol['pipeline_depth']
+    frame = request_frame(protocol['payload_size'])
+    cnt = 0
+    attempts = 3000
+    log_data = new_log_data(SERVER_TYPE,
+                            threading.current_thread().native_id,
+                            total_clients_quantity)
+
+    t_connect = time.perf_counter_ns()
     while attempts:
         try:
             clt.connect(address)
+            connect_ns = time.perf_counter_ns() - t_connect
             attempt_number = 3001 - attempts
             attempts = 3000
             break
@@ -91,40 +161,81 @@ def client_sock(SERVER_TYPE: str,
         clt.close()
         return None
 
+    log_data['conn_attempt'] = attempt_number
+    log_data['connect_ns'] = connect_ns
+
+    # Requests sent but not answered yet, in order: their rows and send
+    # times. With pipelining a reader thread takes the responses while this
+    # thread sends, so neither side waits on a full send buffer
+    in_flight: queue.Queue[tuple[LogData, int]] = queue.Queue()
+    window = threading.Semaphore(depth)  # free pipeline slots
+    # Error that ended the connection: a failure may leave part of a frame
+    # behind, so nothing more is sent or read, the remaining exchanges are
+    # logged with the error
+    broken = ''
+
+    def send_one() -> None:
+        nonlocal cnt, broken
+        row = log_data.copy()
+        row['send_id'] = cnt
+        cnt += 1
+        if broken:
+            in_flight.put((row, 0))
+            return
+        REQUEST.pack_into(
+         frame, 0, len(frame), row['send_id'] & MARK_MASK, random.random())
+        t_send_attempt = time.time()
+        t_send_ns = time.perf_counter_ns()
+        row['t_send_attempt'] = round(t_send_attempt, 6)
+        try:
+            clt.sendall(frame)
+            row['t_send_success'] = round(time.time() - t_send_attempt, 6)
+        except Exception as ex:
+            broken = error_text(ex)
+        in_flight.put((row, t_send_ns))
+
+    def receive_one() -> None:
+        nonlocal broken
+        row, t_send_ns = in_flight.get()
+        try:
+            if not broken:
+                t_recv = recv_response(clt)
+                if t_recv is None:
+                    raise ConnectionError(
+                     "Server closed connection prematurely"
+                     )
+                row['rtt_ns'] = time.perf_counter_ns() - t_send_ns
+                # print('client:', t_recv)
+                _, _, t_server_response, server_ns =\
+                 RESPONSE.unpack(t_recv)
+                row['server_ns'] = server_ns
+                row['t_server_response'] = round(t_server_response, 6)
+                row['t_response'] =\
+                 round(time.time() - t_server_response, 6)
+        except Exception as ex:
+            broken = error_text(ex)
+        finally:
+            if broken and row['rtt_ns'] is None:
+                row['error'] = broken
+            QUE.put(row)
+            window.release()
+
+    def receive_all() -> None:
+        for _ in range(exchanges):
+            receive_one()
+
+    reader = None
     try:
-        while cnt < CNT:
-            try:
-                try:
-                    clear_log(log_data)
-                    data_float = random.random()
-                    data_bytes: bytes = struct.pack('!hd', cnt, data_float)
-                    log_data['conn_attempt'] = attempt_number
-                    t_send_attempt = time.time()
-                    log_data['send_id'] = cnt
-                    log_data['t_send_attempt'] = round(t_send_attempt, 6)
-                    clt.send(data_bytes)
-                    # print('sended', data_bytes)
-                    t_send_success = round(time.time() - t_send_attempt, 6)
-                    log_data['t_send_success'] = t_send_success
-                    t_recv = recv_all(clt, 10) # Read exactly 10 bytes
-                    if t_recv is None:
-                        raise ConnectionError(
-                         "Server closed connection prematurely"
-                         )
-                    # print('client:', t_recv)
-                    t_server_response: float = struct.unpack('!hd', t_recv)[1]
-                    log_data['t_server_response'] = round(t_server_response, 6)
-                    t_response: float = round(time.time() - t_server_response, 6)
-                    log_data['t_response'] = t_response
-                except Exception as ex:
-                    log_data['error'] = ex.args[1]\
-                     if len(ex.args) > 1 else str(ex)
-                finally:
-                    cnt += 1
-                    QUE.put(log_data.copy())
-            except OSError as ex:
-                print(f"!!! UNCAUGHT OSError in exchange cycle: {ex}")
-                break
+        if depth > 1:
+            reader = threading.Thread(target=receive_all, daemon=True)
+            reader.start()
+        for _ in range(exchanges):
+            window.acquire()
+            send_one()
+            if reader is None:
+                receive_one()
+        if reader is not None:
+            reader.join()
     finally:
         try:
             clt.shutdown(socket.SHUT_RDWR)
@@ -136,11 +247,615 @@ def client_sock(SERVER_TYPE: str,
             pass
 
 
+async def client_coro(SERVER_TYPE: str,
+ total_clients_quantity: int, QUE: LogQueue, client_id: int,
+ protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    """
+    Coroutine counterpart of client_sock: the same connect retries,
+    pipelined exchanges and LogData records, without a thread per client.
+    """
+    exchanges = protocol['exchanges']
+    depth = protocol['pipeline_depth']
+    frame = request_frame(protocol['payload_size'])
+    log_data = new_log_data(SERVER_TYPE, client_id, total_clients_quantity)
+    streams = await connect_with_retries(log_data, QUE)
+    if streams is None:
+        return None
+    reader, writer = streams
+
+    # Requests sent but not answered yet, in order: a receiver task takes
+    # the responses while the pipeline is filled, so neither side waits on
+    # a full send buffer
+    in_flight: asyncio.Queue[tuple[LogData, int]] = asyncio.Queue()
+    window = asyncio.Semaphore(depth)  # free pipeline slots
+    broken = ''  # error that ended the connection, as in client_sock
+
+    async def send() -> None:
+        nonlocal broken
+        for cnt in range(exchanges):
+            await window.acquire()
+            row = log_data.copy()
+            row['send_id'] = cnt
+            if broken:
+                in_flight.put_nowait((row, 0))
+                continue
+            REQUEST.pack_into(
+             frame, 0, len(frame), cnt & MARK_MASK, random.random())
+            t_send_attempt = time.time()
+            t_send_ns = time.perf_counter_ns()
+            row['t_send_attempt'] = round(t_send_attempt, 6)
+            try:
+                # The transport may keep a reference to unsent data,
+                # so it gets its own copy of the reused frame
+                writer.write(bytes(frame))
+                await writer.drain()
+                row['t_send_success'] = round(time.time() - t_send_attempt, 6)
+            except Exception as ex:
+                broken = error_text(ex)
+            in_flight.put_nowait((row, t_send_ns))
+
+    async def receive() -> None:
+        nonlocal broken
+        for _ in range(exchanges):
+            row, t_send_ns = await in_flight.get()
+            try:
+                if not broken:
+                    try:
+                        t_recv = await read_response(reader)
+                    except asyncio.IncompleteReadError:
+                        raise ConnectionError(
+                         "Server closed connection prematurely")
+                    row['rtt_ns'] = time.perf_counter_ns() - t_send_ns
+                    _, _, t_server_response, server_ns =\
+                     RESPONSE.unpack(t_recv)
+                    row['server_ns'] = server_ns
+                    row['t_server_response'] = round(t_server_response, 6)
+                    row['t_response'] =\
+                     round(time.time() - t_server_response, 6)
+            except Exception as ex:
+                broken = error_text(ex)
+            finally:
+                if broken and row['rtt_ns'] is None:
+                    row['error'] = broken
+                QUE.put(row)
+                window.release()
+
+    try:
+        await asyncio.gather(send(), receive())
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+
+def async_clients(SERVER_TYPE: str, total_clients_quantity: int,
+                  QUE: LogQueue, clients: int | None = None,
+                  first_id: int = 0, barrier: Barrier | None = None,
+                  protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    """
+    Run a whole wave of clients as coroutines on a single event loop
+    (uvloop when installed) and return when every client has finished.
+
+    Args:
+        clients: How many clients this call runs, defaults to the whole
+            wave; a shard runs only its part of total_clients_quantity.
+        first_id: client_id of the first coroutine.
+        barrier: Waited on right before the connect burst.
+        protocol: Payload size, exchanges and pipelining depth.
+    """
+    if clients is None:
+        clients = total_clients_quantity
+
+    async def wave() -> None:
+        await asyncio.gather(*(
+         client_coro(SERVER_TYPE, total_clients_quantity, QUE, client_id,
+                     protocol)
+         for client_id in range(first_id, first_id + clients)))
+
+    if barrier is not None:
+        barrier.wait()
+    if uvloop is not None:
+        uvloop.run(wave())
+    else:
+        asyncio.run(wave())
+
+
+def threaded_clients(SERVER_TYPE: str, total_clients_quantity: int,
+                     QUE: LogQueue, clients: int | None = None,
+                     first_id: int = 0, barrier: Barrier | None = None,
+                     protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    # client_id of a thread is its native id, first_id is not needed
+    if clients is None:
+        clients = total_clients_quantity
+    clts = []
+    for _ in range(clients):
+        clts.append(threading.Thread(target=client_sock,
+         args=(SERVER_TYPE, total_clients_quantity, QUE, protocol)))
+    print(f'made {len(clts)}')
+    if barrier is not None:
+        barrier.wait()
+    print('start')
+    for x in clts:
+        x.start()
+    for x in clts:
+        x.join()
+
+
+DEFAULT_TARGET_RPS = 10_000  # open-loop requests per second of a wave
+START_LEAD = 0.05  # seconds between the last connect and the first send
+
+
+async def open_loop_connect(SERVER_TYPE: str,
+ total_clients_quantity: int, QUE: LogQueue, client_id: int
+ ) -> tuple[asyncio.StreamReader, asyncio.StreamWriter, LogData] | None:
+    """
+    Connect like client_coro. Returns the streams and the row template of
+    the connection, None (the failure is logged) if every attempt failed.
+    """
+    log_data = new_log_data(SERVER_TYPE, client_id, total_clients_quantity)
+    streams = await connect_with_retries(log_data, QUE)
+    return None if streams is None else (*streams, log_data)
+
+
+async def open_loop_coro(QUE: LogQueue, reader: asyncio.StreamReader,
+ writer: asyncio.StreamWriter, log_data: LogData, intended_ns: list[int],
+ wall_offset: float,
+ protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    """
+    Exchanges of one open-loop connection. Every request is sent at its
+    intended time (perf_counter_ns) whether earlier responses have arrived
+    or not, a reader task pairs the responses with the requests in order.
+    co_rtt_ns counts from the intended send time, so the time a request
+    waited behind a slow server, or a late sender, is not omitted. Once
+    the connection fails, the requests still scheduled are logged with
+    the error instead of being sent.
+    """
+    frame = request_frame(protocol['payload_size'])
+    in_flight: asyncio.Queue[tuple[LogData, int, int] | None] =\
+     asyncio.Queue()
+    broken = ''  # error that ended the connection
+
+    async def send() -> None:
+        nonlocal broken
+        for send_id, intended in enumerate(intended_ns):
+            row = log_data.copy()
+            row['send_id'] = send_id
+            row['t_intended'] = round(wall_offset + intended / 1e9, 6)
+            if broken:
+                row['error'] = broken
+                QUE.put(row)
+                continue
+            delay = intended - time.perf_counter_ns()
+            if delay > 0:
+                await asyncio.sleep(delay / 1e9)
+            REQUEST.pack_into(frame, 0, len(frame), send_id & MARK_MASK,
+                              random.random())
+            t_send_attempt = time.time()
+            t_send_ns = time.perf_counter_ns()
+            row['t_send_attempt'] = round(t_send_attempt, 6)
+            try:
+                writer.write(bytes(frame))
+                await writer.drain()
+                row['t_send_success'] = round(time.time() - t_send_attempt, 6)
+            except Exception as ex:
+                broken = error_text(ex)
+                row['error'] = broken
+                QUE.put(row)
+                continue
+            in_flight.put_nowait((row, t_send_ns, intended))
+        in_flight.put_nowait(None)
+
+    async def receive() -> None:
+        nonlocal broken
+        while (item := await in_flight.get()) is not None:
+            row, t_send_ns, intended = item
+            if not broken:
+                try:
+                    header = await read_response(reader)
+                    t_recv_ns = time.perf_counter_ns()
+                    _, _, t_server_response, server_ns =\
+                     RESPONSE.unpack(header)
+                    row['rtt_ns'] = t_recv_ns - t_send_ns
+                    row['co_rtt_ns'] = t_recv_ns - intended
+                    row['server_ns'] = server_ns
+                    row['t_server_response'] = round(t_server_response, 6)
+                    row['t_response'] =\
+                     round(time.time() - t_server_response, 6)
+                except asyncio.IncompleteReadError:
+                    broken = "Server closed connection prematurely"
+                except Exception as ex:
+                    broken = error_text(ex)
+            if broken and row['rtt_ns'] is None:
+                row['error'] = broken
+            QUE.put(row)
+
+    try:
+        await asyncio.gather(send(), receive())
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+
+def open_loop_clients(SERVER_TYPE: str, total_clients_quantity: int,
+                      QUE: LogQueue, clients: int | None = None,
+                      first_id: int = 0, barrier: Barrier | None = None,
+                      protocol: ProtocolConfig = DEFAULT_PROTOCOL,
+                      target_rps: float = DEFAULT_TARGET_RPS) -> None:
+    """
+    Open-loop engine: connect the wave's clients first, then send their
+    clients * exchanges requests on a fixed schedule of target_rps for the
+    whole wave, round-robin over the connections. A slow server cannot
+    lower the offered load: requests never wait for responses, so
+    pipeline_depth does not apply.
+
+    A shard of a wave (clients < total_clients_quantity) offers its share
+    of target_rps.
+    """
+    if clients is None:
+        clients = total_clients_quantity
+    interval_ns = 1e9 * total_clients_quantity / (target_rps * clients)
+    exchanges = protocol['exchanges']
+
+    async def wave() -> None:
+        connections = await asyncio.gather(*(
+         open_loop_connect(SERVER_TYPE, total_clients_quantity, QUE,
+                           client_id)
+         for client_id in range(first_id, first_id + clients)))
+        start_ns = time.perf_counter_ns() + round(START_LEAD * 1e9)
+        # Intended times are kept on the monotonic clock, logged as wall
+        # clock like t_send_attempt
+        wall_offset = time.time() - time.perf_counter_ns() / 1e9
+        await asyncio.gather(*(
+         open_loop_coro(QUE, *connection,
+                        [start_ns + round((slot + k * clients) * interval_ns)
+                         for k in range(exchanges)],
+                        wall_offset, protocol)
+         for slot, connection in enumerate(connections)
+         if connection is not None))
+
+    if barrier is not None:
+        barrier.wait()
+    if uvloop is not None:
+        uvloop.run(wave())
+    else:
+        asyncio.run(wave())
+
+
+async def soak_coro(window: SoakWindow, deadline_ns: int,
+ protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    """
+    One soak connection: pipelined exchanges until the deadline, then the
+    requests in flight are answered. Any failure counts as an error of the
+    window and the connection is opened again, so a server that leaks
+    descriptors or memory per connection shows it over time.
+    """
+    depth = protocol['pipeline_depth']
+    frame = request_frame(protocol['payload_size'])
+    while time.perf_counter_ns() < deadline_ns:
+        try:
+            reader, writer = await asyncio.wait_for(
+             asyncio.open_connection(*address), 2.0)
+        except Exception:
+            window.errors += 1
+            await asyncio.sleep(.1)
+            continue
+        # Send times of unanswered requests: the sender keeps up to depth
+        # of them in flight while this loop reads the responses
+        in_flight: asyncio.Queue[int | None] = asyncio.Queue()
+        slots = asyncio.Semaphore(depth)
+
+        # Arguments, not closure variables: a cancelled sender may still run
+        # its finally after the next connection rebinds them
+        async def send(writer: asyncio.StreamWriter,
+                       in_flight: asyncio.Queue[int | None],
+                       slots: asyncio.Semaphore) -> None:
+            cnt = 0
+            try:
+                while time.perf_counter_ns() < deadline_ns:
+                    await slots.acquire()
+                    REQUEST.pack_into(frame, 0, len(frame), cnt & MARK_MASK,
+                                      random.random())
+                    cnt += 1
+                    writer.write(bytes(frame))
+                    in_flight.put_nowait(time.perf_counter_ns())
+                    await writer.drain()
+            finally:
+                in_flight.put_nowait(None)
+
+        sender = asyncio.create_task(send(writer, in_flight, slots))
+        try:
+            while (t_send_ns := await in_flight.get()) is not None:
+                await read_response(reader)
+                window.add(time.perf_counter_ns() - t_send_ns)
+                slots.release()
+            await sender  # raises its write error, if any
+        except Exception:
+            window.errors += 1
+        finally:
+            sender.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+async def soak_sampler(window: SoakWindow, SERVER_TYPE: str,
+ connections: int, QUE: LogQueue, start_ns: int,
+ server_pid: int | None) -> None:
+    """
+    Put a soak_series record of the window into QUE every SOAK_WINDOW
+    seconds until cancelled, then one for the rest of the last window.
+    """
+    second = 0
+    last = start_ns
+    try:
+        while True:
+            tick = start_ns + round((second + 1) * SOAK_WINDOW * 1e9)
+            await asyncio.sleep(max(0, tick - time.perf_counter_ns()) / 1e9)
+            now = time.perf_counter_ns()
+            QUE.put(window.record(SERVER_TYPE, connections, second,
+                                  (now - last) / 1e9, server_pid))
+            second += 1
+            last = now
+    except asyncio.CancelledError:
+        if window.requests or window.errors:
+            QUE.put(window.record(
+             SERVER_TYPE, connections, second,
+             (time.perf_counter_ns() - last) / 1e9, server_pid))
+        raise
+
+
+def soak_clients(SERVER_TYPE: str, connections: int, QUE: LogQueue,
+                 duration: float, server_pid: int | None = None,
+                 protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    """
+    Keep `connections` connections exchanging for `duration` seconds on
+    one event loop and log a soak_series record per second (throughput,
+    p50/p99 RTT, errors, open descriptors and RSS of the server_pid
+    process tree) instead of a row per exchange.
+    """
+    async def soak() -> None:
+        window = SoakWindow()
+        start_ns = time.perf_counter_ns()
+        deadline_ns = start_ns + round(duration * 1e9)
+        sampler = asyncio.create_task(soak_sampler(
+         window, SERVER_TYPE, connections, QUE, start_ns, server_pid))
+        await asyncio.gather(*(soak_coro(window, deadline_ns, protocol)
+                               for _ in range(connections)))
+        sampler.cancel()
+        await asyncio.gather(sampler, return_exceptions=True)
+
+    if uvloop is not None:
+        uvloop.run(soak())
+    else:
+        asyncio.run(soak())
+
+
+ClientEngine = Callable[..., None]
+CLIENT_ENGINES: dict[str, tuple[str, ClientEngine]] = {
+ '1': ('threads', threaded_clients),
+ '2': ('asyncio', async_clients),
+ '3': ('open-loop', open_loop_clients)
+}
+
+
+def client_shard(run_clients: ClientEngine, SERVER_TYPE: str,
+                 total_clients_quantity: int, clients: int, first_id: int,
+                 QUE: LogQueue, barrier: Barrier, core: int | None,
+                 protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    """
+    Body of one load generator process: pin itself to a core, prepare its
+    share of the wave and start it together with the other shards.
+    Results go straight to the log writer queue.
+    """
+    if core is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {core})
+    run_clients(SERVER_TYPE, total_clients_quantity, QUE, clients,
+                first_id, barrier, protocol)
+
+
+def sharded_clients(run_clients: ClientEngine, SERVER_TYPE: str,
+                    total_clients_quantity: int, QUE: LogQueue,
+                    shards: int,
+                    protocol: ProtocolConfig = DEFAULT_PROTOCOL) -> None:
+    """
+    Split a wave across several generator processes, so load generation
+    is not capped by a single GIL, and wait until all of them finish.
+    """
+    cores = sorted(os.sched_getaffinity(0))\
+     if hasattr(os, 'sched_getaffinity') else []
+    barrier = multiprocessing.Barrier(shards)
+    share, extra = divmod(total_clients_quantity, shards)
+    processes = []
+    first_id = 0
+    for shard in range(shards):
+        clients = share + (shard < extra)
+        processes.append(multiprocessing.Process(
+         target=client_shard,
+         args=(run_clients, SERVER_TYPE, total_clients_quantity, clients,
+               first_id, QUE, barrier,
+               cores[shard % len(cores)] if cores else None, protocol)))
+        first_id += clients
+    for pr in processes:
+        pr.start()
+    for pr in processes:
+        pr.join()
+
+
+# Servers that can stay up for the whole suite: their persistent variant
+PERSISTENT_SERVERS: dict[str, Callable[..., None]] = {
+ 'server_epoll': persistent_epoll
+}
+CONTROL_TIMEOUT = 30.0  # seconds to wait for a persistent server's answer
+
+
+class PersistentServer:
+    """
+    Driver of a server process that serves every wave of a suite, so
+    there is no fork, socket bind or idle timeout between waves.
+    """
+
+    def __init__(self, target: Callable[..., None], QUE: LogQueue,
+                 SERVER_TYPE: str, srv_status: Synchronized,
+                 metrics: ServerMetrics | None = None) -> None:
+        self.control, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+         target=target, args=(child, QUE, SERVER_TYPE, srv_status),
+         kwargs={'shared_metrics': metrics})
+        self.process.start()
+        child.close()  # the server's end: EOF here once it has exited
+        self.requests = 0  # number of the last request sent
+
+    def request(self, *message: object) -> object | None:
+        '''Send a command, return the answer or None if the server is gone
+        or does not answer in CONTROL_TIMEOUT. A late answer to an earlier
+        request is told by its request number and dropped.'''
+        self.requests += 1
+        deadline = time.monotonic() + CONTROL_TIMEOUT
+        try:
+            self.control.send((self.requests, *message))
+            while self.control.poll(max(0.0, deadline - time.monotonic())):
+                request_id, answer = self.control.recv()
+                if request_id == self.requests:
+                    return answer
+        except (EOFError, OSError):
+            pass
+        return None
+
+    def start_wave(self, total_clients_quantity: int) -> bool:
+        return self.request(WAVE_START, total_clients_quantity) is not None
+
+    def end_wave(self) -> dict[str, int | float] | None:
+        stats = self.request(WAVE_END)
+        if stats is not None:
+            print(f"server: accepted {stats['accepted']}, "
+                  f"messages {stats['messages']}, "
+                  f"cpu time {stats['cpu_time']:.3f} s")
+        return stats
+
+    def stop(self) -> None:
+        self.request(SERVER_STOP)
+        self.control.close()
+        self.process.join(CONTROL_TIMEOUT)
+
+
+def ask_protocol() -> ProtocolConfig:
+    '''Interactively read the protocol settings, Enter keeps a default.'''
+    protocol = DEFAULT_PROTOCOL.copy()
+    limits = {
+        'payload_size': (MIN_PAYLOAD, MAX_PAYLOAD),
+        'exchanges': (1, 1_000_000),
+        'pipeline_depth': (1, 1_000_000),
+    }
+    for key, (low, high) in limits.items():
+        while True:
+            value = input(
+             f'    {key} ({low}..{high}, Enter - {protocol[key]}): ').strip()
+            if not value:
+                break
+            if value.isdigit() and low <= int(value) <= high:
+                protocol[key] = int(value)  # type: ignore[literal-required]
+                break
+            print('Wrong value')
+    return protocol
+
+
+def ask_ramp() -> tuple[Ramp, str, float | None, int | None]:
+    '''
+    Interactively choose the wave ramp and, for the adaptive one, what
+    makes a wave fail besides a server crash. Returns the ramp, its
+    description, the error rate and the p99 RTT (ns) limits.
+    '''
+    option = input('''
+    Wave ramp:
+    1 - linear, 64 more clients every wave up to 4096, until the server fails
+    2 - adaptive, double the wave until one fails, then bisect
+     ''').strip()
+    if option != '2':
+        return Ramp(), 'linear', None, None
+
+    max_error_rate: float | None = MAX_ERROR_RATE
+    max_p99_ns: int | None = None
+    while True:
+        value = input(f'    Failing error rate, % '
+                      f'(Enter - {MAX_ERROR_RATE:.0%}): ').strip()
+        try:
+            if value:
+                max_error_rate = float(value) / 100
+            break
+        except ValueError:
+            print('Wrong value')
+    while True:
+        value = input('    Failing p99 RTT, ms (Enter - no limit): ').strip()
+        try:
+            if value:
+                max_p99_ns = round(float(value) * 1e6)
+            break
+        except ValueError:
+            print('Wrong value')
+
+    description = f'adaptive, errors > {max_error_rate:.1%}'
+    if max_p99_ns is not None:
+        description += f', p99 rtt > {max_p99_ns / 1e6:g} ms'
+    return Ramp(adaptive=True), description, max_error_rate, max_p99_ns
+
+
+def run_soak(SERVER_TYPE: str, server_func: Callable[..., None],
+             shared_srv_status: Synchronized) -> None:
+    '''Soak mode of run_test_suite: one server process, a fixed number of
+    connections for a fixed time, per-second records in soak_series.'''
+    while True:
+        connections = input(f'''
+    How many connections? (Enter - {SOAK_CONNECTIONS})
+     ''') or str(SOAK_CONNECTIONS)
+        if connections.isdigit() and int(connections) > 0:
+            connections = int(connections)
+            break
+    while True:
+        duration = input(f'''
+    How many seconds? (Enter - {SOAK_SECONDS})
+     ''') or str(SOAK_SECONDS)
+        if duration.isdigit() and int(duration) > 0:
+            duration = int(duration)
+            break
+
+    print('\n    Protocol settings (exchanges do not apply):')
+    protocol = ask_protocol()
+
+    run_id = start_run(SERVER_TYPE, 'soak', 1, dict(protocol), False,
+                       soak_seconds=duration)
+    print(f'\n    Test run {run_id}, soak of {duration} s')
+    log_writer, server_log_queue = start_log_writer(raw_rows=False,
+                                                    run_id=run_id)
+    metrics = ServerMetrics(blocks=1 + REUSEPORT_WORKERS)
+    scraper = MetricsScraper(metrics, server_log_queue, SERVER_TYPE)
+    scraper.clients_total = connections
+    scraper.start()
+    pr_srv = multiprocessing.Process(target=server_func,
+                                     args=(server_log_queue, SERVER_TYPE,
+                                           connections, shared_srv_status),
+                                     kwargs={'shared_metrics': metrics})
+    pr_srv.start()
+    soak_clients(SERVER_TYPE, connections, server_log_queue, duration,
+                 pr_srv.pid, protocol)
+    pr_srv.join()
+    scraper.stop()
+    stop_log_writer(log_writer, server_log_queue)
+    finish_run(run_id)
+    return None
+
+
 def run_test_suite() -> None:
     shared_srv_status = multiprocessing.Value('b', True)
     while True:
         db_option = input('''
-        Do you want to keep the existing database data? (y/n)
+        Do you want to keep the earlier test runs? (y/n)
          ''')
         if db_option in 'Yy':
             db_erase = False
@@ -152,12 +867,14 @@ def run_test_suite() -> None:
 
     init_db(new=db_erase)
 
-    ServerFunc = Callable[[socket.socket, NamedQueue, str, int], None]
+    ServerFunc = Callable[[LogQueue, str, int, Synchronized], None]
     server_options: dict[str, tuple[str, ServerFunc]] = {
      '1': ('server_select', server_select),
      '2': ('server_unblocked', server_unblocked),
      '3': ('server_mixed', server_mixed),
-     '4': ('server_async', server_async)
+     '4': ('server_async', server_async),
+     '5': ('server_epoll', server_epoll),
+     '6': ('server_reuseport', server_reuseport)
     }
 
     start_message = '''
@@ -166,6 +883,8 @@ def run_test_suite() -> None:
     2 - socket.unblocked
     3 - mixed server using select() for blocking client`s connections
     4 - server on asyncio
+    5 - epoll (selectors fallback), edge-triggered
+    6 - SO_REUSEPORT pool of epoll workers, one per core
     q - exit program
      '''
 
@@ -179,34 +898,163 @@ def run_test_suite() -> None:
             exit()
         time.sleep(0.1)
 
-    for total_clients_quantity in range(64, 4097, 64):
-        print(f'\nserver status = {bool(shared_srv_status.value)}')
-        if not shared_srv_status:
+    mode = input('''
+    Test mode:
+    1 - waves of growing size
+    2 - soak: a fixed number of connections exchanging for a while
+     ''').strip()
+    if mode == '2':
+        run_soak(SERVER_TYPE, set_option[1], shared_srv_status)
+        return None
+
+    persistent = False
+    if SERVER_TYPE in PERSISTENT_SERVERS:
+        persistent = input('''
+    Keep one server process for all waves? ("n" - a new one per wave)
+     ''').strip() not in ('n', 'N')
+
+    while True:
+        option = input('''
+    Choose client engine:
+    1 - thread per client
+    2 - asyncio, all clients on one event loop
+    3 - open loop: asyncio, requests at a constant rate
+     ''') or '1'
+        if option in CLIENT_ENGINES:
+            client_engine, run_clients = CLIENT_ENGINES[option]
             break
+        time.sleep(0.1)
+
+    target_rps: float | None = None
+    while client_engine == 'open-loop':
+        value = input(f'''
+    Requests per second for the whole wave (Enter - {DEFAULT_TARGET_RPS})
+     ''').strip()
+        try:
+            target_rps = float(value) if value else DEFAULT_TARGET_RPS
+        except ValueError:
+            continue
+        if target_rps <= 0:
+            continue
+        # A per-wave server stops after its idle timeout without traffic:
+        # slower requests would find it gone and count as errors
+        idle_timeout = UNBLOCKED_IDLE_TIMEOUT\
+            if SERVER_TYPE == 'server_unblocked' else IDLE_TIMEOUT
+        if not persistent and 1 / target_rps >= idle_timeout:
+            print(f'    Requests would be {1 / target_rps:g} s apart: '
+                  f'{SERVER_TYPE} stops after {idle_timeout:g} idle s')
+            continue
+        run_clients = functools.partial(run_clients, target_rps=target_rps)
+        break
+
+    while True:
+        shards = input('''
+    How many load generator processes? (Enter - 1, in this process)
+     ''') or '1'
+        if shards.isdigit() and int(shards) > 0:
+            shards = int(shards)
+            break
+        time.sleep(0.1)
+
+    print('\n    Protocol settings:')
+    protocol = ask_protocol()
+
+    raw_rows = input('''
+    Store raw rows of every exchange? ("n" keeps only latency sketches)
+     ''').strip() not in ('n', 'N')
+
+    ramp, ramp_description, max_error_rate, max_p99_ns = ask_ramp()
+
+    run_id = start_run(SERVER_TYPE, client_engine, shards, dict(protocol),
+                       raw_rows, target_rps=target_rps)
+    print(f'\n    Test run {run_id}')
+
+    # Server processes never write to SQLite themselves: their logs go
+    # through one long-lived writer process for the whole suite
+    log_writer, server_log_queue = start_log_writer(raw_rows=raw_rows,
+                                                    run_id=run_id)
+
+    server: PersistentServer | None = None
+    probe = WaveProbe()  # error rate and RTT of the wave for the ramp
+    # Live counters of the server processes, a server_metrics row every
+    # SCRAPE_INTERVAL
+    metrics = ServerMetrics(blocks=1 + REUSEPORT_WORKERS)
+    scraper = MetricsScraper(metrics, server_log_queue, SERVER_TYPE)
+    scraper.start()
+
+    thr_send: threading.Thread | None = None
+    for wave, total_clients_quantity in enumerate(ramp):
+        # A failed wave may have stopped the server: the bisection of the
+        # adaptive ramp runs more waves after it
+        shared_srv_status.value = True
+        probe.reset()
+        scraper.clients_total = total_clients_quantity
         print(f'\n{total_clients_quantity} clients\n')
-        QUE = (que_next, que_first)[bool(total_clients_quantity % 128)]
-        pr_srv = multiprocessing.Process(target=set_option[1],
-                                   args=(QUE, SERVER_TYPE,
-                                         total_clients_quantity,
-                                         shared_srv_status))
-        pr_srv.start()
-        clts = []
-        for _ in range(total_clients_quantity):
-            clts.append(threading.Thread(target=client_sock,
-             args=(SERVER_TYPE, total_clients_quantity, QUE)))
-        print(f'made {len(clts)}')
-        print('start')
-        for x in clts:
-            x.start()
-        for x in clts:
-            x.join()
-        pr_srv.join()
+        QUE = (que_first, que_next)[wave % 2]
+        if not persistent:
+            pr_srv = multiprocessing.Process(target=set_option[1],
+                                       args=(server_log_queue, SERVER_TYPE,
+                                             total_clients_quantity,
+                                             shared_srv_status),
+                                       kwargs={'shared_metrics': metrics})
+            pr_srv.start()
+        else:
+            if server is None:
+                server = PersistentServer(PERSISTENT_SERVERS[SERVER_TYPE],
+                                          server_log_queue, SERVER_TYPE,
+                                          shared_srv_status, metrics)
+            if not server.start_wave(total_clients_quantity):
+                print('Server is not responding')
+                ramp.record(total_clients_quantity, 'server not responding')
+                server.stop()
+                server = None
+                continue
+        if shards > 1:
+            # Shards stream their rows to the log writer process
+            sharded_clients(run_clients, SERVER_TYPE,
+                            total_clients_quantity,
+                            ProbedQueue(server_log_queue, probe), shards,
+                            protocol)
+        else:
+            run_clients(SERVER_TYPE, total_clients_quantity,
+                        ProbedQueue(QUE, probe), protocol=protocol)
+        if server is None:
+            pr_srv.join()
+        else:
+            server.end_wave()
+
+        print(f'\nserver status = {bool(shared_srv_status.value)}')
+        failure = probe.failure(bool(shared_srv_status.value),
+                                max_error_rate, max_p99_ns)
+        ramp.record(total_clients_quantity, failure)
+        if failure is not None:
+            print(f'\033[91m{total_clients_quantity} clients: '
+                  f'{failure}\033[0m')
+            if server is not None and not shared_srv_status.value:
+                server.stop()
+                server = None
+        if shards > 1:
+            continue
 
         QUE.put('End')  # type: ignore
-        thr_send = threading.Thread(target=send_to_base, args=(QUE,))
+        thr_send = threading.Thread(target=send_to_base, args=(QUE,),
+                                    kwargs={'raw_rows': raw_rows,
+                                            'run_id': run_id})
         thr_send.start()
 
-    thr_send.join(5)
+    if server is not None:
+        server.stop()
+    if thr_send is not None:
+        thr_send.join(5)
+    scraper.stop()
+    stop_log_writer(log_writer, server_log_queue)
+    print(f'\nKnee: {ramp.knee} clients passed', end='')
+    if ramp.breaking_point is not None:
+        print(f', {ramp.breaking_point} failed ({ramp.failure})')
+    else:
+        print()
+    finish_run(run_id, ramp=ramp_description, knee=ramp.knee or None,
+               breaking_point=ramp.breaking_point, failure=ramp.failure)
     return None
 
 if __name__ == '__main__':
@@ -0,0 +1,154 @@
+# server_metrics.py
+
+import multiprocessing
+import threading
+import time
+
+from types_common import LogQueue, ServerMetricsData
+
+
+# Slots of a block: one block per server process (SO_REUSEPORT workers
+# have their own), so counters are only ever written by one process.
+# Counters only grow, ACTIVE is set by the server loop, MAX_BUSY_NS holds
+# the longest loop iteration since the last scrape
+ACCEPTED, ACTIVE, BYTES_IN, BYTES_OUT, MESSAGES, LOOPS, BUSY_NS, WAIT_NS,\
+    MAX_BUSY_NS = range(9)
+SLOTS = 9
+COUNTERS = {
+    'accepted': ACCEPTED,
+    'bytes_in': BYTES_IN,
+    'bytes_out': BYTES_OUT,
+    'messages': MESSAGES,
+    'loops': LOOPS,
+    'busy_ns': BUSY_NS,  # loop time spent handling events
+    'wait_ns': WAIT_NS,  # loop time spent blocked in select / epoll / sleep
+}
+
+SCRAPE_INTERVAL = 0.1  # seconds between two server_metrics rows
+
+
+class ServerMetrics:
+    """
+    Counters and gauges of a server, written by the server processes and
+    read by the harness. shared=True puts them in shared memory (pass the
+    object to the server processes), else in a private list.
+    """
+    __slots__ = ('values', 'offset', 'blocks')
+
+    def __init__(self, blocks: int=1, shared: bool=True) -> None:
+        self.blocks = blocks
+        self.values = multiprocessing.Array('q', blocks * SLOTS, lock=False)\
+            if shared else [0] * (blocks * SLOTS)
+        self.offset = 0
+
+    def use(self, other: 'ServerMetrics', block: int=0) -> None:
+        '''Count into a block of other's values from now on.'''
+        self.values = other.values
+        self.blocks = other.blocks
+        self.offset = block * SLOTS
+
+    def add(self, slot: int, n: int=1) -> None:
+        self.values[self.offset + slot] += n
+
+    def set(self, slot: int, value: int) -> None:
+        self.values[self.offset + slot] = value
+
+    def iteration(self, start_ns: int, waited_ns: int=0) -> int:
+        '''Account a loop iteration that began at start_ns and spent
+        waited_ns of it waiting. Returns the start of the next one.'''
+        now = time.perf_counter_ns()
+        busy = now - start_ns - waited_ns
+        values, offset = self.values, self.offset
+        values[offset + LOOPS] += 1
+        values[offset + BUSY_NS] += busy
+        values[offset + WAIT_NS] += waited_ns
+        if busy > values[offset + MAX_BUSY_NS]:
+            values[offset + MAX_BUSY_NS] = busy
+        return now
+
+    def snapshot(self) -> dict[str, int]:
+        '''Totals over all blocks, then start a new MAX_BUSY_NS window. A
+        maximum written between the read and the reset may be missed.'''
+        values = self.values[:]
+        totals = {name: sum(values[slot::SLOTS])
+                  for name, slot in COUNTERS.items()}
+        totals['active'] = sum(values[ACTIVE::SLOTS])
+        totals['max_busy_ns'] = max(values[MAX_BUSY_NS::SLOTS])
+        for block in range(self.blocks):
+            self.values[block * SLOTS + MAX_BUSY_NS] = 0
+        return totals
+
+
+def listen_backlog(port: int) -> int | None:
+    '''
+    Connections waiting in the accept queues of the listening sockets on
+    port: rx_queue of the LISTEN rows of /proc/net/tcp and tcp6. Read by
+    the harness, so a stalled server loop cannot hide it. None without
+    /proc.
+    '''
+    local = f':{port:04X}'
+    backlog = None
+    for path in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        backlog = backlog or 0
+        for line in lines:
+            if ' 0A ' not in line:  # state LISTEN
+                continue
+            fields = line.split()
+            if fields[1].endswith(local) and fields[3] == '0A':
+                backlog += int(fields[4].split(':')[1], 16)
+    return backlog
+
+
+class MetricsScraper:
+    """
+    Harness thread putting a server_metrics row into the log queue every
+    SCRAPE_INTERVAL: counter increments since the previous row, gauges as
+    they are. Idle windows (no activity, nothing connected or waiting) are
+    skipped. Set clients_total before every wave.
+    """
+
+    def __init__(self, metrics: ServerMetrics, QUE: LogQueue,
+                 SERVER_TYPE: str, port: int=5959,
+                 interval: float=SCRAPE_INTERVAL) -> None:
+        self.metrics = metrics
+        self.QUE = QUE
+        self.SERVER_TYPE = SERVER_TYPE
+        self.port = port
+        self.interval = interval
+        self.clients_total = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='metrics_scraper')
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self) -> None:
+        previous = self.metrics.snapshot()
+        while not self.stopped.wait(self.interval):
+            current = self.metrics.snapshot()
+            backlog = listen_backlog(self.port)
+            row: ServerMetricsData = {
+                'log_type': 'metrics',
+                'server_type': self.SERVER_TYPE,
+                'clients_total': self.clients_total,
+                'timestamp': round(time.time(), 6),
+                'active': current['active'],
+                **{name: current[name] - previous[name]
+                   for name in COUNTERS},  # type: ignore[typeddict-item]
+                'max_busy_ns': current['max_busy_ns'],
+                'backlog': backlog,
+            }
+            previous = current
+            if row['active'] or row['messages'] or row['accepted']\
+                    or backlog:
+                self.QUE.put(row)
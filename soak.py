@@ -0,0 +1,97 @@
+# soak.py
+
+import os
+import time
+
+from collections import Counter
+from latency_sketch import bucket_bounds, bucket_of
+from types_common import SoakData
+
+
+SOAK_CONNECTIONS = 256  # default connections kept busy
+SOAK_SECONDS = 300  # default duration
+SOAK_WINDOW = 1.0  # seconds per soak_series record
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class SoakWindow:
+    """
+    Completed exchanges, errors and an RTT histogram (latency_sketch
+    buckets) since the last record. Fed by the coroutines of one event
+    loop, so no locking is needed.
+    """
+    __slots__ = ('requests', 'errors', 'latency')
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.latency: Counter[int] = Counter()
+
+    def add(self, rtt_ns: int) -> None:
+        self.requests += 1
+        self.latency[bucket_of(max(0, rtt_ns))] += 1
+
+    def quantile(self, q: float) -> int | None:
+        '''Upper bound of the bucket holding the q-quantile, in ns.'''
+        rank = q * self.requests
+        if not rank:
+            return None
+        seen = 0
+        for bucket in sorted(self.latency):
+            seen += self.latency[bucket]
+            if seen >= rank:
+                return bucket_bounds(bucket)[1]
+        return None
+
+    def record(self, SERVER_TYPE: str, connections: int, second: int,
+               elapsed: float, server_pid: int | None) -> SoakData:
+        '''soak_series row of this window, then start the next one.'''
+        open_fds, rss_bytes = process_stats(server_pid)
+        row: SoakData = {
+            'log_type': 'soak',
+            'server_type': SERVER_TYPE,
+            'clients_total': connections,
+            'second': second,
+            'timestamp': round(time.time(), 6),
+            'requests': self.requests,
+            'rps': round(self.requests / elapsed, 3) if elapsed > 0 else None,
+            'p50_ns': self.quantile(0.5),
+            'p99_ns': self.quantile(0.99),
+            'errors': self.errors,
+            'open_fds': open_fds,
+            'rss_bytes': rss_bytes,
+        }
+        self.requests = self.errors = 0
+        self.latency.clear()
+        return row
+
+
+def _process_tree(pid: int) -> list[int]:
+    '''pid and its descendants (the SO_REUSEPORT workers of a server).'''
+    tree = [pid]
+    for parent in tree:
+        try:
+            with open(f'/proc/{parent}/task/{parent}/children') as f:
+                tree.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return tree
+
+
+def process_stats(pid: int | None) -> tuple[int | None, int | None]:
+    '''
+    Open file descriptors and resident memory in bytes of a process and
+    its children, read from /proc. (None, None) where that is unavailable.
+    '''
+    if pid is None or not os.path.isdir(f'/proc/{pid}'):
+        return None, None
+    open_fds = rss_bytes = 0
+    for member in _process_tree(pid):
+        try:
+            open_fds += len(os.listdir(f'/proc/{member}/fd'))
+            with open(f'/proc/{member}/statm') as f:
+                rss_bytes += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue  # exited meanwhile
+    return open_fds, rss_bytes
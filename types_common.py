@@ -2,6 +2,7 @@
 
 import queue
 
+from multiprocessing.queues import Queue as MPQueue
 from typing import TypedDict, Literal
 
 
@@ -16,6 +17,15 @@ class LogData(TypedDict):
     t_send_success: float | None
     t_server_response: float | None
     t_response: float | None
+    # Monotonic integer nanoseconds, comparable at microsecond scale
+    connect_ns: int | None
+    rtt_ns: int | None
+    server_ns: int | None
+    # Open-loop load only: when the schedule meant the request to be sent
+    # (wall clock) and the latency measured from then, which includes the
+    # time it waited behind a slow server (coordinated omission)
+    t_intended: float | None
+    co_rtt_ns: int | None
     error: str
 
 
@@ -28,10 +38,60 @@ class ServerLogData(TypedDict):
     timestamp: float
 
 
-LogDict = LogData | ServerLogData
+class ServerStatsData(TypedDict):
+    log_type: Literal['stats']
+    server_type: str
+    clients_total: int
+    metric: str
+    value: float
+    timestamp: float
+
+
+class SoakData(TypedDict):
+    log_type: Literal['soak']
+    server_type: str
+    clients_total: int  # connections kept busy
+    second: int  # window number since the soak started
+    timestamp: float
+    requests: int  # exchanges completed in the window
+    rps: float | None
+    p50_ns: int | None
+    p99_ns: int | None
+    errors: int
+    # Server process and its children, None where /proc is unavailable
+    open_fds: int | None
+    rss_bytes: int | None
+
+
+class ServerMetricsData(TypedDict):
+    log_type: Literal['metrics']
+    server_type: str
+    clients_total: int
+    timestamp: float
+    # Gauges
+    active: int  # connections the server holds
+    max_busy_ns: int  # longest loop iteration in the window
+    backlog: int | None  # connections waiting to be accepted
+    # Increments in the window
+    accepted: int
+    bytes_in: int
+    bytes_out: int
+    messages: int
+    loops: int
+    busy_ns: int
+    wait_ns: int
+
+
+LogDict = LogData | ServerLogData | ServerStatsData | SoakData\
+    | ServerMetricsData
 
 
 class NamedQueue(queue.Queue[LogDict]):
     def __init__(self, name: str):
         super().__init__()
         self.name = name
+
+
+# Anything a log producer may put rows into: the per-wave client queues
+# drained by send_to_base or the log writer process queue
+LogQueue = NamedQueue | MPQueue
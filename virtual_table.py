@@ -0,0 +1,88 @@
+# virtual_table.py
+
+import tkinter as tk
+
+from db_utils import QueryPager
+from itertools import zip_longest
+from tkinter import ttk
+
+
+class VirtualTable:
+    """
+    Treeview showing a scrollable window over the rows of a QueryPager.
+
+    Only `height` Treeview items ever exist: scrolling refills them with the
+    page at the new offset, so a table of millions of rows opens and scrolls
+    as fast as a small one. Clicking a heading sorts by that column in SQL
+    (again to reverse the order).
+    """
+
+    def __init__(self, master: tk.Misc, pager: QueryPager,
+                 headers: list[str], height: int=30) -> None:
+        self.pager = pager
+        self.height = height
+        self.offset = 0
+        self.sorted_by: tuple[int, bool] | None = None  # column, descending
+        self.headers = headers
+
+        frame = tk.Frame(master)
+        frame.pack(fill=tk.BOTH, expand=True)
+        self.scrollbar = tk.Scrollbar(frame, orient=tk.VERTICAL,
+                                      command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree = ttk.Treeview(frame, columns=pager.columns,
+                                 show="headings", height=height)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Configure columns: heading text, center alignment, SQL sort
+        for i, (col, head) in enumerate(zip(pager.columns, headers)):
+            self.tree.heading(col, text=head, anchor="center",
+                              command=lambda i=i: self.sort_by(i))
+            self.tree.column(col, anchor="center")
+        self.items = [self.tree.insert("", "end", values=())
+                      for _ in range(height)]
+
+        for sequence, step in (("<Button-4>", -3), ("<Button-5>", 3),
+                               ("<Up>", -1), ("<Down>", 1),
+                               ("<Prior>", -height), ("<Next>", height)):
+            self.tree.bind(sequence,
+                           lambda event, step=step: self.scroll(step))
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll(
+            -3 if event.delta > 0 else 3))
+        self.tree.bind("<Home>", lambda event: self.scroll_to(0))
+        self.tree.bind("<End>", lambda event: self.scroll_to(pager.total))
+        self.refresh()
+
+    def refresh(self) -> None:
+        '''Fill the Treeview items with the rows at the current offset.'''
+        rows = self.pager.page(self.offset, self.height)
+        for item, row in zip_longest(self.items, rows, fillvalue=()):
+            self.tree.item(item, values=row)
+        total = max(self.pager.total, 1)
+        self.scrollbar.set(self.offset / total,
+                           min(self.offset + self.height, total) / total)
+
+    def scroll_to(self, offset: int) -> str:
+        self.offset = max(0, min(offset, self.pager.total - self.height))
+        self.refresh()
+        return "break"  # the Treeview has nothing to scroll itself
+
+    def scroll(self, rows: int) -> str:
+        return self.scroll_to(self.offset + rows)
+
+    def yview(self, action: str, value: str, unit: str | None=None) -> None:
+        '''Scrollbar command: ('moveto', fraction) or ('scroll', n, unit).'''
+        if action == 'moveto':
+            self.scroll_to(int(float(value) * self.pager.total))
+        elif action == 'scroll':
+            self.scroll(int(value) * (self.height if unit == 'pages' else 1))
+
+    def sort_by(self, column: int) -> None:
+        descending = self.sorted_by == (column, False)
+        self.pager.sort(column, descending)
+        self.sorted_by = (column, descending)
+        for i, (col, head) in enumerate(zip(self.pager.columns,
+                                            self.headers)):
+            mark = (' ▼' if descending else ' ▲') if i == column else ''
+            self.tree.heading(col, text=head + mark)
+        self.scroll_to(0)